@@ -5,6 +5,7 @@ import time
 import numpy
 import scipy.sparse
 import scipy.sparse.linalg
+import scipy.linalg
 import matplotlib.pyplot
 import argparse
 import json
@@ -0,0 +1,172 @@
+
+# Basic modules
+from fatDAE.base.basic_import import *
+
+class elementary(object):
+    ''' Elementary step size controller.
+
+    The step size is scaled by a factor of the error estimate :math:`e_n` of the last step
+
+    .. math::
+        \\begin{equation}
+            \\rho_n = e_n^{-1/k}
+        \\end{equation}
+
+    where :math:`k` is the minimum order of the embedded methods plus one, scaled by the safety factor
+    and bounded. After a rejection every controller falls back to the elementary one, and only accepted
+    steps enter the history.
+
+    Within the hysteresis band :attr:`band` the step size is kept, so that the factorizations of the
+    iteration matrices are reused when the step size would barely change.
+
+    Attributes:
+        band (:obj:`tuple`): Bounds of the scaled factors which keep the step size, None to disable it.
+        e (:obj:`list`): Error estimates of the last accepted steps, the latest first.
+        h (:obj:`list`): Step sizes of the last accepted steps, the latest first.
+        rejected (:obj:`bool`): True if the last step was rejected, False otherwise.
+    '''
+
+    # Number of accepted steps kept
+    n_history = 1
+
+    def __init__(self, band=None):
+
+        self.band = band
+
+        self.reset()
+
+    def reset(self):
+        ''' Forgets the history, before a new resolution.
+        '''
+
+        self.e = []
+        self.h = []
+
+        self.rejected = False
+
+    def factor(self, e, h, k):
+        ''' Computes the factor of an accepted step from the history.
+
+        Args:
+            e (:obj:`list`): Error estimates, the latest first, including the actual one.
+            h (:obj:`list`): Step sizes, the latest first, including the actual one.
+            k (:obj:`int`): Minimum order of the embedded methods plus one.
+
+        Returns:
+            (:obj:`float`): Factor of the step size.
+        '''
+
+        return (1.0 / e[0]) ** (1.0 / k)
+
+    def __call__(self, error, h, k, s_fac=1.0, f_min=0., f_max=numpy.inf):
+        ''' Computes the scaled factor of the step size after one step.
+
+        Args:
+            error (:obj:`float`): Error estimate of the step, accepted if under one.
+            h (:obj:`float`): Step size of the step.
+            k (:obj:`int`): Minimum order of the embedded methods plus one.
+            s_fac (:obj:`float`, optional): Safety factor.
+            f_min (:obj:`float`, optional): Maximum step size decreasing factor.
+            f_max (:obj:`float`, optional): Maximum step size increasing factor.
+
+        Returns:
+            (:obj:`float`): Factor of the step size.
+        '''
+
+        error = max(error, 1e-10)
+
+        if error < 1.0:
+
+            e = [error] + self.e
+            h = [h] + self.h
+
+            if self.rejected or len(e) < self.n_history:
+                fac = elementary.factor(self, e, h, k)
+            else:
+                fac = self.factor(e, h, k)
+
+            self.e = e[:self.n_history]
+            self.h = h[:self.n_history]
+
+            self.rejected = False
+
+            fac = min(f_max, max(f_min, s_fac * fac))
+
+            if self.band == None:
+                pass
+            else:
+
+                if self.band[0] <= fac <= self.band[1]:
+                    fac = 1.0
+
+        else:
+
+            self.rejected = True
+
+            fac = min(f_max, max(f_min, s_fac * (1.0 / error) ** (1.0 / k)))
+
+        return fac
+
+class gustafsson(elementary):
+    ''' Predictive PI controller by Gustafsson.
+
+    .. math::
+        \\begin{equation}
+            \\rho_n = \\frac{h_n}{h_{n-1}}\\left(\\frac{e_{n-1}}{e_n^2}\\right)^{1/k}
+        \\end{equation}
+
+    The smaller of this factor and the elementary one is taken, as in RADAU5 [Hairer and Wanner, IV.8].
+    '''
+
+    n_history = 2
+
+    def factor(self, e, h, k):
+        return min((1.0 / e[0]) ** (1.0 / k), h[0] / h[1] * (e[1] / e[0] ** 2) ** (1.0 / k))
+
+class h211b(elementary):
+    ''' H211b digital filter controller by Söderlind.
+
+    .. math::
+        \\begin{equation}
+            \\rho_n = \\left(e_ne_{n-1}\\right)^{-1/(bk)}\\left(\\frac{h_n}{h_{n-1}}\\right)^{-1/b}
+        \\end{equation}
+
+    Attributes:
+        b (:obj:`float`): Filter parameter, 4 by default.
+    '''
+
+    n_history = 2
+
+    def __init__(self, band=None, b=4.0):
+
+        self.b = b
+
+        elementary.__init__(self, band)
+
+    def factor(self, e, h, k):
+        return (e[0] * e[1]) ** (-1.0 / (self.b * k)) * (h[0] / h[1]) ** (-1.0 / self.b)
+
+class pid(elementary):
+    ''' PID digital filter controller by Söderlind.
+
+    .. math::
+        \\begin{equation}
+            \\rho_n = e_n^{-\\beta_1/k}e_{n-1}^{-\\beta_2/k}e_{n-2}^{-\\beta_3/k}
+        \\end{equation}
+
+    Attributes:
+        beta (:obj:`tuple`): Coefficients :math:`(\\beta_1, \\beta_2, \\beta_3)`, those of H312PID by default.
+    '''
+
+    n_history = 3
+
+    def __init__(self, band=None, beta=(1.0 / 18.0, 1.0 / 9.0, 1.0 / 18.0)):
+
+        self.beta = beta
+
+        elementary.__init__(self, band)
+
+    def factor(self, e, h, k):
+        return numpy.prod([e[j] ** (-self.beta[j] / k) for j in range(3)])
+
+controllers = {'elementary': elementary, 'gustafsson': gustafsson, 'h211b': h211b, 'pid': pid}
@@ -0,0 +1,431 @@
+
+# Basic modules
+from fatDAE.base.basic_import import *
+
+# User defined
+import fatDAE.base.class_solvers_sp
+
+def coloring(pattern):
+    ''' Groups the columns of a sparsity pattern following Curtis, Powell and Reid.
+
+    Two columns can share a group, or color, if they do not have non-zeros in the same row, so they can
+    be perturbed at once. The groups are built greedily, which for banded patterns gives as many
+    groups as the bandwidth.
+
+    Args:
+        pattern (:obj:`scipy.sparse.csc_matrix`): Sparsity pattern.
+
+    Returns:
+        (tuple): Tuple containing:
+
+        - **colors** (:obj:`numpy.ndarray`): Group of each column.
+        - **n_colors** (:obj:`int`): Number of groups.
+    '''
+
+    S = scipy.sparse.csc_matrix(pattern, dtype=bool).astype(float)
+
+    # Columns sharing at least one row
+    G = scipy.sparse.csr_matrix(S.transpose().dot(S))
+
+    n = S.shape[1]
+
+    colors = - numpy.ones(n, dtype=int)
+
+    for j in range(n):
+
+        used = colors[G.indices[G.indptr[j]:G.indptr[j + 1]]]
+
+        free = numpy.ones(n + 1, dtype=bool); free[used[used >= 0]] = False
+
+        colors[j] = numpy.argmax(free)
+
+    return colors, int(colors.max()) + 1
+
+class fd_jacobian(object):
+    ''' Jacobian by finite differences exploiting its sparsity pattern.
+
+    The columns are grouped by :func:`coloring` and all the columns of one group are perturbed at once,
+    so the jacobian costs as many evaluations of the function as groups
+
+    .. math::
+        \\begin{equation}
+            \\frac{\\partial f_i}{\\partial x_j}(\\mathbf{x}) \\approx \\frac{f_i(\\mathbf{x} + \\sum_{k\\in c(j)}\\epsilon_k\\mathbf{e}_k) - f_i(\\mathbf{x})}{\\epsilon_j}
+        \\end{equation}
+
+    were :math:`c(j)` is the group of column :math:`j` and
+
+    .. math::
+        \\begin{equation}
+            \\epsilon_j = \\mathrm{sign}(x_j)\\epsilon\\max(|x_j|, 1)
+        \\end{equation}
+
+    so tiny components are not perturbed below the rounding of the state, taking the sign of zero as
+    positive. The perturbations actually representable, :math:`(x_j + \\epsilon_j) - x_j`, are used. The
+    result is assembled straight into the pattern.
+
+    If the function is vectorized, that is, it maps a block of states by columns to a block of values,
+    all the perturbed states are evaluated in one call.
+
+    Attributes:
+        pattern (:obj:`scipy.sparse.csc_matrix`): Sparsity pattern, None if dense.
+        epsilon (:obj:`float`): Relative perturbation.
+        vectorized (:obj:`bool`): True if the function accepts a block of states, False otherwise.
+        colors (:obj:`numpy.ndarray`): Group of each column.
+        n_colors (:obj:`int`): Number of groups.
+    '''
+
+    def __init__(self, pattern=None, epsilon=1e-8, vectorized=False):
+
+        self.epsilon = epsilon
+
+        self.vectorized = vectorized
+
+        if pattern is None:
+
+            self.pattern = None
+
+        else:
+
+            self.pattern = scipy.sparse.csc_matrix(pattern, dtype=bool); self.pattern.sort_indices()
+
+            self.colors, self.n_colors = coloring(self.pattern)
+
+            # Column of each non-zero
+            self.cols = numpy.repeat(numpy.arange(self.pattern.shape[1]), numpy.diff(self.pattern.indptr))
+
+    def __call__(self, f, x, dense=False, f_x=None):
+        ''' Evaluates the jacobian.
+
+        Args:
+            f (:obj:`function`): Function of the state.
+            x (:obj:`numpy.ndarray`): State.
+            dense (:obj:`bool`, optional): True to return a dense array, False to return a sparse matrix.
+            f_x (:obj:`numpy.ndarray`, optional): Value of the function at the state, if already known.
+
+        Returns:
+            (:obj:`scipy.sparse.csc_matrix`): Jacobian.
+        '''
+
+        epsilon = numpy.where(x < 0., - 1.0, 1.0) * self.epsilon * numpy.maximum(numpy.abs(x), 1.0); epsilon = (x + epsilon) - x
+
+        if self.vectorized:
+
+            if self.pattern is None:
+                Y = numpy.tile(x.reshape(-1, 1), (1, x.size + 1)); Y[numpy.arange(x.size), numpy.arange(1, x.size + 1)] += epsilon
+            else:
+                Y = numpy.column_stack((x, x.reshape(-1, 1) + (self.colors.reshape(-1, 1) == numpy.arange(self.n_colors)) * epsilon.reshape(-1, 1)))
+
+            F = f(Y); D = F[:, 1:] - F[:, :1]
+
+            if self.pattern is None:
+                A = D / epsilon
+            else:
+                A = scipy.sparse.csc_matrix((D[self.pattern.indices, self.colors[self.cols]] / epsilon[self.cols], self.pattern.indices, self.pattern.indptr), shape=self.pattern.shape)
+
+            if dense:
+                return fatDAE.base.class_solvers_sp.to_dense(A)
+            else:
+                return scipy.sparse.csc_matrix(A)
+
+        if f_x is None:
+            f_x = f(x)
+
+        if self.pattern is None:
+
+            A = numpy.zeros((f_x.size, x.size))
+
+            for j in range(x.size):
+
+                y = x.copy(); y[j] += epsilon[j]
+
+                A[:, j] = (f(y) - f_x) / epsilon[j]
+
+        else:
+
+            D = numpy.zeros((f_x.size, self.n_colors))
+
+            for c in range(self.n_colors):
+
+                y = x + numpy.where(self.colors == c, epsilon, 0.)
+
+                D[:, c] = f(y) - f_x
+
+            data = D[self.pattern.indices, self.colors[self.cols]] / epsilon[self.cols]
+
+            A = scipy.sparse.csc_matrix((data, self.pattern.indices, self.pattern.indptr), shape=self.pattern.shape)
+
+        if dense:
+            return fatDAE.base.class_solvers_sp.to_dense(A)
+        else:
+            return scipy.sparse.csc_matrix(A)
+
+class cs_jacobian(fd_jacobian):
+    ''' Jacobian by complex step exploiting its sparsity pattern.
+
+    The columns are grouped as in :class:`fd_jacobian`, but the perturbations are imaginary
+
+    .. math::
+        \\begin{equation}
+            \\frac{\\partial f_i}{\\partial x_j}(\\mathbf{x}) \\approx \\frac{\\text{Im}\\, f_i(\\mathbf{x} + \\mathrm{i}\\epsilon\\sum_{k\\in c(j)}\\mathbf{e}_k)}{\\epsilon}
+        \\end{equation}
+
+    so there is no cancellation, the perturbation can be as small as :math:`10^{-20}` and the columns are
+    exact to machine precision, with one evaluation of the function per group and none at the state.
+    The function must accept complex states and be built from analytic operations, that is, without
+    :func:`abs`, comparisons or explicit conversions to real numbers.
+
+    Attributes:
+        pattern (:obj:`scipy.sparse.csc_matrix`): Sparsity pattern, None if dense.
+        epsilon (:obj:`float`): Imaginary perturbation.
+        vectorized (:obj:`bool`): True if the function accepts a block of states, False otherwise.
+    '''
+
+    def __init__(self, pattern=None, epsilon=1e-20, vectorized=False):
+
+        fd_jacobian.__init__(self, pattern, epsilon, vectorized)
+
+    def imag(self, f, Y):
+        ''' Evaluates a function at complex states, returning the imaginary part over the perturbation.
+        '''
+
+        F = f(Y)
+
+        if numpy.iscomplexobj(F):
+            return F.imag / self.epsilon
+        else:
+            raise NameError('The function does not accept complex states, use finite differences...')
+
+    def __call__(self, f, x, dense=False, f_x=None):
+        ''' Evaluates the jacobian.
+
+        Args:
+            f (:obj:`function`): Function of the state.
+            x (:obj:`numpy.ndarray`): State.
+            dense (:obj:`bool`, optional): True to return a dense array, False to return a sparse matrix.
+            f_x (:obj:`numpy.ndarray`, optional): Value of the function at the state, not required.
+
+        Returns:
+            (:obj:`scipy.sparse.csc_matrix`): Jacobian.
+        '''
+
+        if self.pattern is None:
+            n_groups = x.size; groups = numpy.arange(x.size)
+        else:
+            n_groups = self.n_colors; groups = self.colors
+
+        if self.vectorized:
+
+            D = self.imag(f, x.reshape(-1, 1) + 1j * self.epsilon * (groups.reshape(-1, 1) == numpy.arange(n_groups)))
+
+        else:
+
+            D = None
+
+            for c in range(n_groups):
+
+                d = self.imag(f, x + 1j * self.epsilon * (groups == c))
+
+                if D is None:
+                    D = numpy.zeros((d.size, n_groups))
+
+                D[:, c] = d
+
+        if self.pattern is None:
+            A = D
+        else:
+            A = scipy.sparse.csc_matrix((D[self.pattern.indices, self.colors[self.cols]], self.pattern.indices, self.pattern.indptr), shape=self.pattern.shape)
+
+        if dense:
+            return fatDAE.base.class_solvers_sp.to_dense(A)
+        else:
+            return scipy.sparse.csc_matrix(A)
+
+jacobians = {'forward': fd_jacobian, 'complex': cs_jacobian}
+
+class fd_directional(object):
+    ''' Second order directional derivatives by nested finite differences.
+
+    The directional derivative of the jacobian along a direction is computed as the jacobian of a
+    directional difference of the function
+
+    .. math::
+        \\begin{equation}
+            \\frac{\\partial^2 \\mathbf{f}}{\\partial \\mathbf{x}^2}(\\mathbf{x})\\mathbf{y} \\approx \\frac{\\partial}{\\partial \\mathbf{x}}\\left(\\frac{\\mathbf{f}(\\mathbf{x} + \\delta\\mathbf{y}) - \\mathbf{f}(\\mathbf{x})}{\\delta}\\right)
+        \\end{equation}
+
+    by :class:`fd_jacobian`, so no intermediate jacobian is assembled and the columns are still grouped
+    by the sparsity pattern, which also holds for the second derivatives. As two differences are
+    nested, the relative perturbation of both defaults to the cubic root of the machine precision.
+
+    Attributes:
+        epsilon (:obj:`float`): Relative perturbation.
+        jacobian (:obj:`fd_jacobian`): Jacobian of the directional differences.
+    '''
+
+    def __init__(self, pattern=None, epsilon=6e-6, vectorized=False):
+
+        self.epsilon = epsilon
+
+        self.jacobian = fd_jacobian(pattern, epsilon, vectorized)
+
+    def step(self, x, y):
+        ''' Returns the perturbation along a direction.
+
+        Args:
+            x (:obj:`numpy.ndarray`): Point.
+            y (:obj:`numpy.ndarray`): Direction.
+
+        Returns:
+            (:obj:`float`): Perturbation, None if the direction is null.
+        '''
+
+        norm = numpy.max(numpy.abs(y))
+
+        if norm == 0.:
+            return None
+
+        return self.epsilon * max(1.0, numpy.max(numpy.abs(x))) / norm
+
+    def __call__(self, f_1, f_0, x, delta, dense=False):
+        ''' Evaluates the jacobian of a difference of functions.
+
+        .. math::
+            \\begin{equation}
+                \\frac{\\partial}{\\partial \\mathbf{x}}\\left(\\frac{\\mathbf{f}_1(\\mathbf{x}) - \\mathbf{f}_0(\\mathbf{x})}{\\delta}\\right)
+            \\end{equation}
+
+        Args:
+            f_1 (:obj:`function`): Perturbed function of the state.
+            f_0 (:obj:`function`): Function of the state.
+            x (:obj:`numpy.ndarray`): State.
+            delta (:obj:`float`): Perturbation.
+            dense (:obj:`bool`, optional): True to return a dense array, False to return a sparse matrix.
+
+        Returns:
+            (:obj:`scipy.sparse.csc_matrix`): Jacobian.
+        '''
+
+        def g(z):
+            return (f_1(z) - f_0(z)) / delta
+
+        return self.jacobian(g, x, dense)
+
+def detect_pattern(f, x, method='random', n_probes=2, delta=1e-3, vectorized=False, seed=0):
+    ''' Detects the sparsity pattern of the jacobian of a function.
+
+    With method 'random' the jacobian is computed column by column by finite differences at
+    :attr:`n_probes` random points near the given state, and any entry which changes in any of them
+    is kept. As a function always computes the same value from the same inputs, the entries which do
+    not depend on the perturbed variable do not change at all.
+
+    With method 'nan' each variable is set to NaN in turn and the entries becoming NaN are kept, which
+    is exact for functions built from NumPy arithmetic, but misses dependencies through comparisons.
+
+    Args:
+        f (:obj:`function`): Function of the state.
+        x (:obj:`numpy.ndarray`): State.
+        method (:obj:`str`, optional): 'random' or 'nan'.
+        n_probes (:obj:`int`, optional): Number of random points.
+        delta (:obj:`float`, optional): Relative distance of the random points to the state.
+        vectorized (:obj:`bool`, optional): True if the function accepts a block of states by columns, then all the perturbations of one point are evaluated in one call.
+        seed (:obj:`int`, optional): Seed of the random points, drawn from a local generator so the global one is not altered.
+
+    Returns:
+        (:obj:`scipy.sparse.csc_matrix`): Boolean sparsity pattern.
+    '''
+
+    if vectorized:
+
+        def g(y):
+            return f(y.reshape(-1, 1))[:, 0]
+
+    else:
+        g = f
+
+    rows = []
+    cols = []
+
+    if method == 'random':
+
+        rng = numpy.random.RandomState(seed)
+
+        for k in range(n_probes):
+
+            z = x + delta * (1.0 + abs(x)) * rng.uniform(-1.0, 1.0, x.size)
+
+            epsilon = delta * (1.0 + abs(z))
+
+            if vectorized:
+
+                Y = numpy.tile(z.reshape(-1, 1), (1, x.size + 1)); Y[numpy.arange(x.size), numpy.arange(1, x.size + 1)] += epsilon
+
+                F = f(Y); i, j = numpy.nonzero(F[:, 1:] != F[:, :1])
+
+                rows.append(i); cols.append(j)
+
+            else:
+
+                f_z = f(z)
+
+                for j in range(x.size):
+
+                    y = z.copy(); y[j] += epsilon[j]
+
+                    i = numpy.flatnonzero(f(y) != f_z)
+
+                    rows.append(i); cols.append(numpy.full(i.size, j))
+
+    else:
+        if method == 'nan':
+
+            f_x = g(x)
+
+            for j in range(x.size):
+
+                y = numpy.array(x, dtype=float); y[j] = numpy.nan
+
+                i = numpy.flatnonzero(numpy.isnan(g(y)) & ~ numpy.isnan(f_x))
+
+                rows.append(i); cols.append(numpy.full(i.size, j))
+
+        else:
+            raise NameError('Unknown detection method...')
+
+    rows = numpy.concatenate(rows)
+    cols = numpy.concatenate(cols)
+
+    n = numpy.asarray(g(x)).size
+
+    return scipy.sparse.csc_matrix((numpy.ones(rows.size, dtype=bool), (rows, cols)), shape=(n, x.size), dtype=bool)
+
+def matrix_pattern(M, t, x, n_probes=2, delta=1e-3, seed=0):
+    ''' Detects the sparsity pattern of a matrix, or of a matrix depending on the state.
+
+    Args:
+        M (:obj:`function`): Matrix, or function of time and state returning it.
+        t (:obj:`float`): Time.
+        x (:obj:`numpy.ndarray`): State.
+        n_probes (:obj:`int`, optional): Number of random points.
+        delta (:obj:`float`, optional): Relative distance of the random points to the state.
+        seed (:obj:`int`, optional): Seed of the random points, drawn from a local generator so the global one is not altered.
+
+    Returns:
+        (:obj:`scipy.sparse.csc_matrix`): Boolean sparsity pattern.
+    '''
+
+    if callable(M):
+
+        P = scipy.sparse.csc_matrix(M(t, x) != 0)
+
+        rng = numpy.random.RandomState(seed)
+
+        for k in range(n_probes):
+
+            z = x + delta * (1.0 + abs(x)) * rng.uniform(-1.0, 1.0, x.size)
+
+            P = P + scipy.sparse.csc_matrix(M(t, z) != 0)
+
+    else:
+        P = scipy.sparse.csc_matrix(M != 0)
+
+    return scipy.sparse.csc_matrix(P, dtype=bool)
@@ -0,0 +1,188 @@
+
+# Basic modules
+from fatDAE.base.basic_import import *
+
+# User defined
+import fatDAE.base.class_stats
+
+class manager(object):
+    ''' Manager of the evaluations of the matrix and the source derivative with respect to the state.
+
+    The last evaluation is cached together with the time and state at which it was made, and it is
+    reused as long as it is not stale. It becomes stale when
+
+    - the caller asks for it, as after a Newton failure or a slow contraction rate, see
+      :class:`fatDAE.base.class_solvers_nl.solver_nt`,
+    - the state moved more than :attr:`x_ratio` relative to the state of the evaluation
+
+    .. math::
+        \\begin{equation}
+            ||\\mathbf{x} - \\mathbf{x}_J||_\\infty > r_x||\\mathbf{x}_J||_\\infty
+        \\end{equation}
+
+    Every evaluation increases :attr:`version`, so that factorizations of matrices built from previous
+    evaluations are not reused. The iteration matrices :math:`M - h_Ja J` are built with a step size
+    :math:`h_J` which is only updated when it differs from the actual one more than :attr:`h_ratio`.
+
+    Attributes:
+        M (:obj:`function`): Matrix, or function of time and state returning it.
+        dfdx (:obj:`function`): Source derivative with respect to the state, or function of time and state returning it.
+        x_ratio (:obj:`float`): Relative state change above which the jacobian is evaluated again, None to ignore it.
+        h_ratio (:obj:`float`): Relative step size change above which the iteration matrix is rebuilt.
+        version (:obj:`int`): Number of evaluations.
+        t (:obj:`float`): Time of the last evaluation, None if none.
+        x (:obj:`numpy.ndarray`): State of the last evaluation, None if none.
+        h (:obj:`float`): Step size of the iteration matrices, None if none.
+        stats (:obj:`fatDAE.base.class_stats.stats`): Statistics, the evaluations are counted as 'jacobian' and the reuses as 'jacobian reuse'.
+    '''
+
+    def __init__(self, x_ratio=None, h_ratio=2e-1):
+
+        self.x_ratio = x_ratio
+        self.h_ratio = h_ratio
+
+        self.stats = fatDAE.base.class_stats.stats()
+
+        self.reset(None, None)
+
+    def attach(self, stats):
+        ''' Records the statistics in a given instance, see :class:`fatDAE.base.class_stats.stats`.
+        '''
+
+        self.stats = stats
+
+    def reset(self, M, dfdx):
+        ''' Forgets the cached evaluation and sets the functions of a new problem.
+
+        Args:
+            M (:obj:`function`): Matrix, or function of time and state returning it.
+            dfdx (:obj:`function`): Source derivative with respect to the state, or function of time and state returning it.
+        '''
+
+        self.M    = M
+        self.dfdx = dfdx
+
+        self.M_J    = None
+        self.dfdx_J = None
+
+        self.version = 0
+
+        self.t = None
+        self.x = None
+        self.h = None
+
+        self.n_evaluations = 0
+        self.n_reuses      = 0
+
+    def evaluate(self, t, x):
+        ''' Evaluates the matrix and the source derivative with respect to the state.
+
+        Args:
+            t (:obj:`float`): Time.
+            x (:obj:`numpy.ndarray`): State.
+
+        Returns:
+            (tuple): Tuple containing:
+
+            - **M** (:obj:`scipy.sparse.csc_matrix`): Matrix.
+            - **dfdx** (:obj:`scipy.sparse.csc_matrix`): Source derivative with respect to the state.
+        '''
+
+        self.stats.tic('jacobian')
+
+        if callable(self.M) or callable(self.dfdx) or self.dfdx_J is None:
+            self.version = self.version + 1; self.n_evaluations = self.n_evaluations + 1; self.stats.count('jacobian')
+
+        if callable(self.M):
+            self.M_J = self.M(t, x)
+        else:
+            self.M_J = self.M
+
+        if callable(self.dfdx):
+            self.dfdx_J = self.dfdx(t, x)
+        else:
+            self.dfdx_J = self.dfdx
+
+        self.t = t
+        self.x = x
+
+        self.stats.toc('jacobian')
+
+        return self.M_J, self.dfdx_J
+
+    def stale(self, t, x):
+        ''' Checks if the cached evaluation can not be used at a given time and state.
+
+        Args:
+            t (:obj:`float`): Time.
+            x (:obj:`numpy.ndarray`): State.
+
+        Returns:
+            (:obj:`bool`): True if the jacobian must be evaluated again, False otherwise.
+        '''
+
+        if self.dfdx_J is None:
+            return True
+
+        if self.x_ratio == None:
+            return False
+
+        return numpy.linalg.norm(x - self.x, numpy.inf) > self.x_ratio * numpy.linalg.norm(self.x, numpy.inf)
+
+    def request(self, t, x, refresh=False):
+        ''' Returns the matrix and the source derivative with respect to the state, evaluating them only if stale.
+
+        Args:
+            t (:obj:`float`): Time.
+            x (:obj:`numpy.ndarray`): State.
+            refresh (:obj:`bool`, optional): True to force the evaluation.
+
+        Returns:
+            (tuple): Tuple containing:
+
+            - **M** (:obj:`scipy.sparse.csc_matrix`): Matrix.
+            - **dfdx** (:obj:`scipy.sparse.csc_matrix`): Source derivative with respect to the state.
+        '''
+
+        if refresh or self.stale(t, x):
+            return self.evaluate(t, x)
+
+        self.n_reuses = self.n_reuses + 1; self.stats.count('jacobian reuse')
+
+        return self.M_J, self.dfdx_J
+
+    def matrix(self, a, h):
+        ''' Builds an iteration matrix from the cached evaluation.
+
+        .. math::
+            \\begin{equation}
+                M(t_J, \\mathbf{x}_J) - h_Ja\\frac{\\partial \\mathbf{f}}{\\partial\\mathbf{x} }(t_J,\\mathbf{x}_J)
+            \\end{equation}
+
+        Args:
+            a (:obj:`float`): Diagonal coefficient of the stage.
+            h (:obj:`float`): Actual step size.
+
+        Returns:
+            (tuple): Tuple containing:
+
+            - **J** (:obj:`scipy.sparse.csc_matrix`): Iteration matrix.
+            - **key** (:obj:`tuple`): Key identifying the iteration matrix.
+        '''
+
+        if self.h == None or abs(h / self.h - 1.0) > self.h_ratio:
+            self.h = h
+
+        return self.M_J - self.h * a * self.dfdx_J, (self.h, a, self.version)
+
+    def rate(self):
+        ''' Returns the fraction of requests served without evaluating.
+
+        Returns:
+            (:obj:`float`): Reuse rate, None if nothing was requested.
+        '''
+
+        if self.n_evaluations + self.n_reuses == 0:
+            return None
+
+        return self.n_reuses / float(self.n_evaluations + self.n_reuses)
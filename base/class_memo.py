@@ -0,0 +1,83 @@
+
+# Basic modules
+from fatDAE.base.basic_import import *
+
+# User defined
+import fatDAE.base.class_stats
+
+class memo(object):
+    ''' Memo of the last evaluations of a function of time and state.
+
+    Along one step the same function is often evaluated several times at the same point, as the source
+    at :math:`(t_n, \\mathbf{x}_n)` for the initial guess of the first stage and for the derivative with
+    respect to time, or the matrix at one Newton iterate for the residual and for its derivative.
+    The last :attr:`size` evaluations are kept with a copy of their state, and returned again when the
+    time and the state are exactly the same.
+
+    Attributes:
+        function (:obj:`function`): Function of time and state.
+        name (:obj:`str`): Name of the function, the reuses are counted as 'name reuse'.
+        size (:obj:`int`): Number of evaluations kept.
+        stats (:obj:`fatDAE.base.class_stats.stats`): Statistics.
+    '''
+
+    def __init__(self, name, size=4):
+
+        self.name = name
+        self.size = size
+
+        self.stats = fatDAE.base.class_stats.stats()
+
+        self.reset(None)
+
+    def attach(self, stats):
+        ''' Records the statistics in a given instance, see :class:`fatDAE.base.class_stats.stats`.
+        '''
+
+        self.stats = stats
+
+    def reset(self, function):
+        ''' Forgets the evaluations and sets the function of a new problem.
+
+        Args:
+            function (:obj:`function`): Function of time and state.
+        '''
+
+        self.function = function
+
+        self.clear()
+
+    def clear(self):
+        ''' Forgets the evaluations, as when the function changes.
+        '''
+
+        self.entries = []
+
+    def __call__(self, t, x):
+        ''' Evaluates the function, or returns a previous evaluation at the same time and state.
+
+        Args:
+            t (:obj:`float`): Time.
+            x (:obj:`numpy.ndarray`): State.
+
+        Returns:
+            Value of the function.
+        '''
+
+        for k in range(len(self.entries)):
+
+            t_k, x_k, value = self.entries[k]
+
+            if t_k == t and numpy.array_equal(x_k, x):
+
+                self.stats.count(self.name + ' reuse')
+
+                return value
+
+        value = self.function(t, x)
+
+        self.entries.insert(0, (t, numpy.array(x, copy=True), value))
+
+        del self.entries[self.size:]
+
+        return value
@@ -0,0 +1,148 @@
+
+# Basic modules
+from fatDAE.base.basic_import import *
+
+import logging
+
+class observer(object):
+    ''' Observer of the progress of a resolution, silent.
+
+    The drivers :meth:`fatDAE.class_solvers.RK.solve_fxd` and :meth:`fatDAE.class_solvers.RK.solve_adp`
+    call :meth:`start` once, :meth:`step` before every step, accepted or not, and :meth:`finish` once.
+    The steps are only reported by :meth:`report`, overridden by the subclasses, every :attr:`every`
+    steps or every :attr:`seconds` seconds, whatever comes first.
+
+    Attributes:
+        every (:obj:`int`): Number of steps between reports, None to ignore it.
+        seconds (:obj:`float`): Time in seconds between reports, None to ignore it.
+        n_steps (:obj:`int`): Number of steps observed.
+    '''
+
+    # Meaning of the values returned by the drivers
+    status = {0: 'Minimum stepsize reached', 1: 'Final time reached', 2: 'Stopped by the state machine'}
+
+    def __init__(self, every=None, seconds=None):
+
+        self.every   = every
+        self.seconds = seconds
+
+        self.n_steps = 0
+
+        self.started = time.time()
+        self.last    = self.started
+
+    def start(self, solver):
+        ''' Starts observing a resolution.
+
+        Args:
+            solver (:obj:`fatDAE.class_solvers.RK`)
+        '''
+
+        self.n_steps = 0
+
+        self.started = time.time()
+        self.last    = self.started
+
+    def step(self, solver):
+        ''' Observes one step, reporting it if due.
+
+        Args:
+            solver (:obj:`fatDAE.class_solvers.RK`)
+        '''
+
+        self.n_steps = self.n_steps + 1
+
+        now = time.time()
+
+        if (self.every != None and self.n_steps % self.every == 0) or (self.seconds != None and now - self.last >= self.seconds):
+
+            self.last = now
+
+            self.report(self.info(solver))
+
+    def finish(self, solver, status):
+        ''' Ends observing a resolution, which is always reported.
+
+        Args:
+            solver (:obj:`fatDAE.class_solvers.RK`)
+            status (:obj:`int`): Value returned by the driver, see :attr:`status`.
+        '''
+
+        info = self.info(solver); info['status'] = self.status[status]
+
+        self.report(info, True)
+
+    def info(self, solver):
+        ''' Collects the state of a resolution.
+
+        Args:
+            solver (:obj:`fatDAE.class_solvers.RK`)
+
+        Returns:
+            (:obj:`dict`): Time 't', step size 'h', steps observed 'steps', accepted 'a_steps', rejected 'r_steps' and diverged 'd_steps', and seconds 'elapsed'.
+        '''
+
+        return {'t': solver.t, 'h': solver.h, 'steps': self.n_steps, \
+                'a_steps': solver.a_steps, 'r_steps': solver.r_steps, 'd_steps': solver.d_steps, \
+                'elapsed': time.time() - self.started}
+
+    def report(self, info, final=False):
+        ''' Reports the state of a resolution, nothing by default.
+
+        Args:
+            info (:obj:`dict`): State, see :meth:`info`, with the 'status' if final.
+            final (:obj:`bool`, optional): True at the end of the resolution, False otherwise.
+        '''
+        pass
+
+class printer(observer):
+    ''' Observer printing the progress, by default every step.
+    '''
+
+    def __init__(self, every=1, seconds=None):
+        observer.__init__(self, every, seconds)
+
+    def report(self, info, final=False):
+
+        if final:
+
+            print('Elapsed time: ', info['elapsed'])
+
+            print('Accept. steps: ', info['a_steps'])
+            print('Reject. steps: ', info['r_steps'])
+            print('Diverg. steps: ', info['d_steps'])
+
+            print(info['status'])
+
+        else:
+            print('Time ->', info['t'])
+
+class logger(observer):
+    ''' Observer writing the progress to a :obj:`logging.Logger`, by default every 10 seconds.
+
+    Attributes:
+        logger (:obj:`logging.Logger`): Logger, 'fatDAE' by default.
+        level (:obj:`int`): Level of the records.
+    '''
+
+    def __init__(self, every=None, seconds=10., logger=None, level=logging.INFO):
+
+        observer.__init__(self, every, seconds)
+
+        if logger == None:
+            self.logger = logging.getLogger('fatDAE')
+        else:
+            self.logger = logger
+
+        self.level = level
+
+    def report(self, info, final=False):
+
+        if final:
+            self.logger.log(self.level, '%s at t = %g in %.3f s: %d accepted, %d rejected, %d diverged steps', \
+                            info['status'], info['t'], info['elapsed'], info['a_steps'], info['r_steps'], info['d_steps'])
+        else:
+            self.logger.log(self.level, 't = %g, h = %g, %d steps: %d accepted, %d rejected, %d diverged', \
+                            info['t'], info['h'], info['steps'], info['a_steps'], info['r_steps'], info['d_steps'])
+
+observers = {'silent': observer, 'print': printer, 'logging': logger}
@@ -4,6 +4,7 @@ from fatDAE.base.basic_import import *
 
 # User defined
 import fatDAE.base.class_solvers_sp
+import fatDAE.base.class_stats
 
 class solver_nl:
 
@@ -14,38 +15,169 @@ class solver_nl:
         self.a_tol = a_tol
         self.r_tol = r_tol
 
+        self.stats = fatDAE.base.class_stats.stats()
+
     def solve(self):
         pass
 
+    def attach(self, stats):
+        ''' Records the statistics in a given instance, see :class:`fatDAE.base.class_stats.stats`.
+        '''
+
+        self.stats = stats
+
+    def renew(self):
+        ''' Marks the data depending on the step, as preconditioners, to be built again.
+        '''
+        pass
+
+    def reset(self, pattern=None):
+        ''' Forgets the data depending on the problem.
+        '''
+        pass
+
 class solver_fp(solver_nl):
 
     def solve(self, F, x):
         pass
 
 class solver_nt(solver_nl):
+    ''' Newton solver.
+
+    In simplified mode the caller is expected to keep the iteration matrix across stages and steps, asking
+    for a new jacobian only when :attr:`refresh` is True. Following Hairer and Wanner, it is set when
+    the iterations do not converge or when the observed contraction rate
 
-    def __init__(self, m_ite=50, a_tol=1e-8, r_tol=1e-8, simplified=False):
+    .. math::
+        \\begin{equation}
+            \\theta_k = \\frac{||\\Delta_k||}{||\\Delta_{k-1}||}
+        \\end{equation}
+
+    exceeds :attr:`theta_max`, see :class:`fatDAE.base.class_jacobian.manager`.
+
+    The contraction rate is also used to predict the iterations left. The iterations are stopped as
+    soon as :math:`\\theta_k \\geq 1` or the predicted error after :attr:`m_ite` iterations
+
+    .. math::
+        \\begin{equation}
+            \\theta_k^{m - k}\\frac{||\\Delta_k||}{\\max(||\\mathbf{x}_k||, a_{tol})}
+        \\end{equation}
+
+    is still above the tolerance, and then a step size reduction factor :attr:`h_fac` is suggested.
+    The iterates are not required to be nonzero, as the initial guess :math:`h\\mathbf{f}(t_n, \\mathbf{x}_n)`
+    at a rest point, only non-finite corrections are taken as divergence.
+
+    Attributes:
+        simplified (:obj:`bool`): True if simplified Newton iterations are used, False otherwise.
+        theta (:obj:`float`): Last contraction rate observed.
+        theta_max (:obj:`float`): Contraction rate above which the jacobian is refreshed.
+        solver (:obj:`fatDAE.base.class_solvers_sp.solver_ls`): Linear solver, :class:`fatDAE.base.class_solvers_sp.solver_lu` by default.
+        refresh (:obj:`bool`): True if the jacobian must be evaluated again, False otherwise.
+        n_ite (:obj:`int`): Predicted number of iterations left, None if unknown.
+        h_fac (:obj:`float`): Suggested step size reduction factor after a failure, None if unknown.
+    '''
+
+    def __init__(self, m_ite=50, a_tol=1e-8, r_tol=1e-8, simplified=False, theta_max=1e-1, solver=None):
 
         solver_nl.__init__(self, m_ite=m_ite, a_tol=a_tol, r_tol=r_tol)
 
-        self.solver = fatDAE.base.class_solvers_sp.solver_sp()
+        if solver == None:
+            self.solver = fatDAE.base.class_solvers_sp.solver_lu()
+        else:
+            self.solver = solver
+
+        self.simplified = simplified
+
+        self.theta = 0.
+        self.theta_max = theta_max
 
-        self.simplified = False
+        self.refresh = True
 
-    def solve(self, F, J, x):
+        self.n_ite = None
+        self.h_fac = None
+
+    def renew(self):
+        ''' Marks the data depending on the step, as preconditioners, to be built again.
+        '''
+
+        self.solver.renew()
+
+    def attach(self, stats):
+        ''' Records the statistics, also of the linear solver, in a given instance.
+        '''
+
+        self.stats = stats; self.solver.attach(stats)
+
+    def reset(self, pattern=None):
+        ''' Forgets the data depending on the problem, as the linear solver backend.
+
+        Args:
+            pattern (:obj:`scipy.sparse.csc_matrix`, optional): Sparsity pattern of the matrices of the new problem.
+        '''
+
+        self.solver.reset(pattern)
+
+    def solve(self, F, J, x, key=None):
+        ''' Solves a non-linear system by Newton iterations.
+
+        If the jacobian is a matrix instead of a function its factorization is computed once and reused
+        in every iteration, and also in later calls with the same key.
+
+        Args:
+            F (:obj:`function`): Non-linear function.
+            J (:obj:`function`): Jacobian of the non-linear function, or a matrix approximating it.
+            x (:obj:`numpy.ndarray`): Initial guess.
+            key (:obj:`tuple`, optional): Key identifying the matrix, see :class:`fatDAE.base.class_solvers_sp.solver_lu`.
+
+        Returns:
+            (tuple): Tuple containing:
+
+            - **x** (:obj:`numpy.ndarray`): Solution.
+            - **j** (:obj:`int`): Number of iterations.
+        '''
 
         self.converged = False; self.diverged = False
 
-        for j in range(self.m_ite):
+        self.theta = 0.
+
+        self.n_ite = None
+        self.h_fac = None
 
+        self.stats.tic('newton'); residuals = []
 
+        if callable(J):
+            pass
+        else:
+            self.solver.factorize(J, key)
+
+        for j in range(self.m_ite):
 
                 if callable(J):
-                    Delta = self.solver.solve(J(x), - F(x))
+                    self.solver.factorize(J(x))
+
+                Delta = self.solver.solve(- F(x))
+
+                # An inexact correction, as from an iterative solver not reaching its tolerance, is not trusted
+                if self.solver.failed:
+
+                    self.diverged = True; self.h_fac = 0.5
+
+                    break
+
+                norm = numpy.linalg.norm(Delta,numpy.inf); error = norm / max(numpy.linalg.norm(x,numpy.inf), self.a_tol)
+
+                residuals.append(error)
+
+                if numpy.isfinite(norm):
+                    pass
                 else:
-                    Delta = self.solver.solve(J, - F(x))
 
-                error = numpy.linalg.norm(Delta,numpy.inf) / numpy.linalg.norm(x,numpy.inf)
+                    self.diverged = True; self.h_fac = 0.5
+
+                    break
+
+                if j > 0:
+                    self.theta = norm / norm_old
 
                 #print(error)
 
@@ -55,15 +187,227 @@ class solver_nt(solver_nl):
 
                     #print "Converged - >", self.converged
 
+                    self.refresh = self.refresh or self.theta > self.theta_max
+
+                    self.stats.record(residuals); self.stats.toc('newton')
+
                     return x, j
                 else:
                     pass
                     #print error
 
+                if j > 0:
+
+                    if self.theta >= 1.0:
+
+                        self.diverged = True; self.h_fac = 0.5
+
+                        break
+
+                    if self.theta > 0.:
+                        self.n_ite = int(numpy.ceil(numpy.log(self.a_tol / error) / numpy.log(self.theta)))
+                    else:
+                        self.n_ite = 1
+
+                    # Convergence is not possible within the remaining iterations
+                    if j + self.n_ite >= self.m_ite:
+
+                        self.diverged = True
+
+                        rate = max(1e-4, min(20.0, self.theta ** (self.m_ite - 1 - j) * error / self.a_tol))
+
+                        self.h_fac = 0.8 * rate ** (- 1.0 / (4.0 + self.m_ite - 1 - j))
+
+                        break
+
                 x = x + Delta
 
-                error_old = error
+                error_old = error; norm_old = norm
+
+        if self.diverged:
+            pass
+        else:
+            self.h_fac = 0.5
+
+        self.refresh = True
+
+        self.stats.record(residuals); self.stats.toc('newton'); self.stats.count('failure')
+
+        return x, j
+
+class solver_kn(solver_nt):
+    ''' Jacobian-free Newton-Krylov solver.
+
+    The Newton corrections are computed by a Krylov method, GMRES or BiCGStab, in which the products
+    with the jacobian are approximated by finite differences of the non-linear function
+
+    .. math::
+        \\begin{equation}
+            J(\\mathbf{x})\\mathbf{v} \\approx \\frac{\\mathbf{F}(\\mathbf{x} + \\epsilon\\mathbf{v}) - \\mathbf{F}(\\mathbf{x})}{\\epsilon}
+        \\end{equation}
+
+    so the jacobian is never assembled. The linear systems are solved up to a relative residual given
+    by the Eisenstat-Walker forcing terms (choice 2)
+
+    .. math::
+        \\begin{equation}
+            \\eta_k = \\gamma\\left(\\frac{||\\mathbf{F}(\\mathbf{x}_k)||}{||\\mathbf{F}(\\mathbf{x}_{k-1})||}\\right)^\\alpha
+        \\end{equation}
+
+    safeguarded by :math:`\\gamma\\eta_{k-1}^\\alpha` and bounded by :attr:`eta_max`. As the corrections
+    are inexact, the contraction rate is measured on the residuals :math:`||\\mathbf{F}(\\mathbf{x}_k)||`.
+
+    If a preconditioner is given, it is built from the assembled jacobian only when it is not ready,
+    see :class:`fatDAE.base.class_solvers_sp.precond`, so it is shared by all the stages and Newton
+    iterations of a step.
+
+    Attributes:
+        method (:obj:`str`): Krylov method, 'gmres' or 'bicgstab'.
+        eta_max (:obj:`float`): Maximum forcing term.
+        gamma (:obj:`float`): Eisenstat-Walker parameter.
+        alpha (:obj:`float`): Eisenstat-Walker parameter.
+        l_ite (:obj:`int`): Maximum number of Krylov iterations per correction.
+        precond (:obj:`fatDAE.base.class_solvers_sp.precond`): Preconditioner, None if not preconditioned.
+    '''
+
+    def __init__(self, m_ite=50, a_tol=1e-8, r_tol=1e-8, method='gmres', eta_max=0.1, gamma=0.9, alpha=2.0, l_ite=50, precond=None):
+
+        solver_nt.__init__(self, m_ite=m_ite, a_tol=a_tol, r_tol=r_tol)
+
+        self.method = method
+
+        self.eta_max = eta_max
+
+        self.gamma = gamma
+        self.alpha = alpha
+
+        self.l_ite = l_ite
+
+        self.precond = precond
+
+    def renew(self):
+        ''' Ages the preconditioner, see :meth:`fatDAE.base.class_solvers_sp.precond.renew`.
+        '''
+
+        if self.precond == None:
+            pass
+        else:
+            self.precond.renew()
+
+    def solve(self, F, J, x, key=None):
+        ''' Solves a non-linear system by Jacobian-free Newton-Krylov iterations.
+
+        Args:
+            F (:obj:`function`): Non-linear function.
+            J (:obj:`function`): Jacobian of the non-linear function, or a matrix approximating it, only used to build the preconditioner.
+            x (:obj:`numpy.ndarray`): Initial guess.
+            key (:obj:`tuple`, optional): Not used, kept for compatibility with :class:`solver_nt`.
+
+        Returns:
+            (tuple): Tuple containing:
+
+            - **x** (:obj:`numpy.ndarray`): Solution.
+            - **j** (:obj:`int`): Number of iterations.
+        '''
+
+        self.converged = False; self.diverged = False
+
+        self.theta = 0.
+
+        self.n_ite = None
+        self.h_fac = None
+
+        eta = self.eta_max
+
+        self.stats.tic('newton'); residuals = []
+
+        F_x = F(x); norm_F = numpy.linalg.norm(F_x)
+
+        if self.precond == None or J is None:
+            P = None
+        else:
+
+            if self.precond.ready:
+                pass
+            else:
+
+                if callable(J):
+                    self.precond.update(J(x))
+                else:
+                    self.precond.update(J)
+
+                self.stats.count('preconditioner')
+
+            P = self.precond.operator()
+
+        for j in range(self.m_ite):
+
+            def Jv(v):
+
+                norm_v = numpy.linalg.norm(v)
+
+                if norm_v == 0.:
+                    return numpy.zeros_like(v)
+
+                epsilon = numpy.sqrt(numpy.finfo(float).eps) * (1.0 + numpy.linalg.norm(x)) / norm_v
+
+                self.stats.count('jv')
+
+                return (F(x + epsilon * v) - F_x) / epsilon
+
+            A = scipy.sparse.linalg.LinearOperator((x.size, x.size), matvec=Jv, dtype=float)
+
+            self.stats.tic('solve')
+
+            Delta, info = fatDAE.base.class_solvers_sp.krylov(A, - F_x, self.method, eta, P, maxiter=self.l_ite)
+
+            self.stats.toc('solve'); self.stats.count('solve')
+
+            norm = numpy.linalg.norm(Delta,numpy.inf); error = norm / max(numpy.linalg.norm(x,numpy.inf), self.a_tol)
+
+            residuals.append(error)
+
+            if numpy.isfinite(norm):
+                pass
+            else:
+
+                self.diverged = True; self.h_fac = 0.5
+
+                break
+
+            if error < self.a_tol:
+
+                self.converged = True
+
+                self.stats.record(residuals); self.stats.toc('newton')
+
+                return x, j
+
+            x = x + Delta
+
+            F_x = F(x); norm_F_old = norm_F; norm_F = numpy.linalg.norm(F_x)
+
+            self.theta = norm_F / norm_F_old
+
+            if self.theta >= 1.0:
+
+                self.diverged = True; self.h_fac = 0.5
+
+                break
+
+            # Eisenstat-Walker forcing term
+            eta_new = self.gamma * (norm_F / norm_F_old) ** self.alpha
+
+            if self.gamma * eta ** self.alpha > 0.1:
+                eta_new = max(eta_new, self.gamma * eta ** self.alpha)
+
+            eta = min(self.eta_max, eta_new)
+
+        if self.diverged:
+            pass
+        else:
+            self.h_fac = 0.5
 
-        print("Converged - >", self.converged)
+        self.stats.record(residuals); self.stats.toc('newton'); self.stats.count('failure')
 
         return x, j
@@ -2,14 +2,134 @@
 # Basic modules
 from fatDAE.base.basic_import import *
 
+import inspect
+
+# User defined
+import fatDAE.base.class_stats
+
+# Optional backends
+try:
+    import scikits.umfpack as umfpack
+except ImportError:
+    umfpack = None
+
+try:
+    import sksparse.cholmod as cholmod
+except ImportError:
+    cholmod = None
+
+def krylov(A, b, method='gmres', rtol=1e-5, M=None, x0=None, maxiter=None):
+    ''' Solves a linear system with a Krylov method from :mod:`scipy.sparse.linalg`.
+
+    Args:
+        A (:obj:`scipy.sparse.linalg.LinearOperator`): Matrix or linear operator.
+        b (:obj:`numpy.ndarray`): Right hand side.
+        method (:obj:`str`, optional): 'gmres' or 'bicgstab'.
+        rtol (:obj:`float`, optional): Relative tolerance on the residual.
+        M (:obj:`scipy.sparse.linalg.LinearOperator`, optional): Preconditioner.
+        x0 (:obj:`numpy.ndarray`, optional): Initial guess.
+        maxiter (:obj:`int`, optional): Maximum number of iterations, for GMRES without restarts.
+
+    Returns:
+        (tuple): Tuple containing:
+
+        - **x** (:obj:`numpy.ndarray`): Solution.
+        - **info** (:obj:`int`): 0 if converged, see :func:`scipy.sparse.linalg.gmres`.
+    '''
+
+    options = {'x0': x0, 'atol': 0., 'M': M, 'maxiter': maxiter}
+
+    if method == 'gmres':
+
+        krylov_method = scipy.sparse.linalg.gmres
+
+        # Without restarts, so maxiter bounds the number of products
+        if maxiter == None:
+            pass
+        else:
+            options['restart'] = maxiter; options['maxiter'] = 1
+
+    else:
+        if method == 'bicgstab':
+            krylov_method = scipy.sparse.linalg.bicgstab
+        else:
+            raise NameError('Unknown Krylov method...')
+
+    # Older versions of scipy name the relative tolerance tol
+    if 'rtol' in inspect.signature(krylov_method).parameters:
+        options['rtol'] = rtol
+    else:
+        options['tol'] = rtol
+
+    return krylov_method(A, b, **options)
+
+def to_dense(A):
+    ''' Converts a matrix to a contiguous dense array.
+
+    Args:
+        A (:obj:`scipy.sparse.csc_matrix`): Sparse or dense matrix.
+
+    Returns:
+        (:obj:`numpy.ndarray`)
+    '''
+
+    if scipy.sparse.issparse(A):
+        return A.toarray()
+    else:
+        return numpy.ascontiguousarray(A, dtype=float)
+
 class solver_ls:
 
     def __init__(self):
-        pass
+        self.stats = fatDAE.base.class_stats.stats()
+
+        # True if the last solve did not reach its tolerance, only possible for iterative solvers
+        self.failed = False
+
+        # Number of factorizations kept, only used by the direct solvers
+        self.size = 1
 
     def solve(self, A, b):
         pass
 
+    def attach(self, stats):
+        ''' Records the statistics in a given instance, see :class:`fatDAE.base.class_stats.stats`.
+        '''
+
+        self.stats = stats
+
+    def renew(self):
+        ''' Marks the data depending on the step, as preconditioners, to be built again.
+        '''
+        pass
+
+    def reset(self, pattern=None):
+        ''' Forgets the data depending on the problem.
+
+        Args:
+            pattern (:obj:`scipy.sparse.csc_matrix`, optional): Sparsity pattern of the matrices of the new problem.
+        '''
+        pass
+
+    def cached(self, key):
+        ''' Checks if the factorization of the matrix with a given key is kept, so it does not need to be built.
+
+        Args:
+            key (:obj:`tuple`): Key identifying the matrix.
+
+        Returns:
+            (:obj:`bool`): True if kept, False otherwise.
+        '''
+
+        return False
+
+    def check(self):
+        ''' Raises an error if the last solve did not reach its tolerance, for callers unable to recover from it.
+        '''
+
+        if self.failed:
+            raise NameError('Linear solver did not converge...')
+
 class solver_sp(solver_ls):
 
     def __init__(self):
@@ -24,4 +144,976 @@ class solver_lq(solver_ls):
         solver_ls.__init__(self)
 
     def solve(self, A, b):
+
+        self.stats.count('lsqr')
+
         return scipy.sparse.linalg.lsqr(A, b, atol=1e-14, btol=1e-14)[0]
+
+class solver_pj(solver_ls):
+    ''' Solver for systems with a constant and possibly singular matrix, as the mass matrix of a DAE.
+
+    The zero rows and columns of the matrix are identified once by :meth:`factorize`, splitting the
+    equations and the variables into differential and algebraic ones. Up to permutations
+
+    .. math::
+        \\begin{equation}
+            M = \\left(\\begin{array}{cc}
+                M_{dd} & 0 \\\\
+                0      & 0
+            \\end{array}\\right)
+        \\end{equation}
+
+    and, if :math:`M_{dd}` is nonsingular, the least squares solution of minimum norm of
+    :math:`M\\mathbf{k} = \\mathbf{b}` is
+
+    .. math::
+        \\begin{equation}
+            \\mathbf{k}_d = M_{dd}^{-1}\\mathbf{b}_d, \\quad \\mathbf{k}_a = 0
+        \\end{equation}
+
+    so each solve only needs the triangular solves with the stored factorization of :math:`M_{dd}`.
+    Otherwise :class:`solver_lq` is used.
+
+    Attributes:
+        rows (:obj:`numpy.ndarray`): Indices of the differential equations.
+        cols (:obj:`numpy.ndarray`): Indices of the differential variables.
+        lusolver (:obj:`solver_lu`): Factorization of :math:`M_{dd}`, None if it is singular.
+        lqsolver (:obj:`solver_lq`): Fallback solver.
+    '''
+
+    def __init__(self):
+        solver_ls.__init__(self)
+
+        self.M = None
+
+        self.rows = None
+        self.cols = None
+
+        self.lusolver = None
+        self.lqsolver = solver_lq()
+
+    def attach(self, stats):
+
+        self.stats = stats; self.lqsolver.attach(stats)
+
+    def factorize(self, A, key=None):
+        ''' Analyzes the structure of a matrix and factorizes its differential block.
+
+        Args:
+            A (:obj:`scipy.sparse.csc_matrix`): Matrix.
+            key (:obj:`tuple`, optional): Not used, kept for compatibility with :class:`solver_lu`.
+        '''
+
+        self.M = scipy.sparse.csc_matrix(A); self.M.eliminate_zeros()
+
+        self.rows = numpy.flatnonzero(numpy.diff(self.M.tocsr().indptr))
+        self.cols = numpy.flatnonzero(numpy.diff(self.M.indptr))
+
+        self.lusolver = None
+
+        if self.rows.size == self.cols.size and self.rows.size > 0:
+
+            try:
+                self.lusolver = solver_lu(); self.lusolver.attach(self.stats)
+
+                self.lusolver.factorize(self.M[self.rows, :][:, self.cols])
+            except RuntimeError:
+                self.lusolver = None
+
+    def invalidate(self):
+
+        self.M = None
+
+        self.lusolver = None
+
+    def solve(self, b, trans='N'):
+        ''' Solves a linear system with the analyzed matrix.
+
+        Args:
+            b (:obj:`numpy.ndarray`): Right hand side.
+            trans (:obj:`str`, optional): Not used, the matrix is assumed to be given as it is.
+
+        Returns:
+            (:obj:`numpy.ndarray`): Solution.
+        '''
+
+        if self.lusolver == None:
+            return self.lqsolver.solve(self.M, b)
+
+        k = numpy.zeros(self.M.shape[1])
+
+        k[self.cols] = self.lusolver.solve(b[self.rows])
+
+        return k
+
+class solver_lu(solver_ls):
+    ''' Sparse direct solver which keeps the LU factorization of the last matrix.
+
+    The factorization computed by :meth:`factorize` is reused by :meth:`solve` until a matrix with a
+    different key is given, the key being chosen by the caller, for example
+
+    .. math::
+        \\begin{equation}
+            (h, \\gamma, v)
+        \\end{equation}
+
+    were :math:`v` is the version of the jacobian used to build :math:`M - h\\gamma J`. The last
+    :attr:`size` factorizations are kept, so a few matrices used alternately, as those of the stages of
+    a DIRK method with different diagonal coefficients, are factorized only once.
+
+    The factorization is computed by SuperLU, other direct backends override :meth:`decompose` and
+    :meth:`substitute`.
+
+    As long as the sparsity pattern does not change, as for :math:`M - h\\gamma J` with a constant
+    pattern, the fill-reducing ordering computed with the first matrix is kept, see :meth:`analyze`,
+    and only the numeric factorization is done again. If the pattern of the problem is given to
+    :meth:`reset`, the matrices are embedded in it, so entries cancelling out do not change it.
+
+    .. inheritance-diagram:: solver_um solver_ch solver_dn
+       :parts: 1
+
+    Attributes:
+        lu (:obj:`scipy.sparse.linalg.SuperLU`): Factorization of the last matrix.
+        key (:obj:`tuple`): Key of the factorized matrix, None if it must be factorized again.
+        indptr (:obj:`numpy.ndarray`): Column pointers of the last analyzed pattern.
+        indices (:obj:`numpy.ndarray`): Row indices of the last analyzed pattern.
+        perm_c (:obj:`numpy.ndarray`): Column ordering of the last analyzed pattern.
+        permuted (:obj:`bool`): True if the stored factorization is the one of the matrix with permuted columns, False otherwise.
+        pattern (:obj:`scipy.sparse.csc_matrix`): Sparsity pattern of the problem, None if unknown.
+        size (:obj:`int`): Number of factorizations kept.
+        cache (:obj:`list`): Keys and factorizations kept, the most recently used first.
+    '''
+
+    def __init__(self):
+        solver_ls.__init__(self)
+
+        self.lu  = None
+        self.key = None
+
+        self.size  = 1
+        self.cache = []
+
+        self.indptr  = None
+        self.indices = None
+
+        self.perm_c   = None
+        self.permuted = False
+
+        self.pattern = None
+
+    def reset(self, pattern=None):
+        ''' Forgets the factorization and the analyzed pattern.
+
+        Args:
+            pattern (:obj:`scipy.sparse.csc_matrix`, optional): Sparsity pattern of the matrices of the new problem.
+        '''
+
+        self.invalidate()
+
+        self.indptr  = None
+        self.indices = None
+
+        self.perm_c = None
+
+        if pattern is None:
+            self.pattern = None
+        else:
+
+            self.pattern = scipy.sparse.csc_matrix(pattern, dtype=bool); self.pattern.sort_indices()
+
+            # Position of each entry of the pattern in column major order
+            self.pattern_keys = numpy.repeat(numpy.arange(self.pattern.shape[1], dtype=numpy.int64), numpy.diff(self.pattern.indptr)) \
+                                                                        * self.pattern.shape[0] + self.pattern.indices
+
+    def canonical(self, A):
+        ''' Converts a matrix to canonical CSC format, embedded in the pattern of the problem if known.
+
+        Args:
+            A (:obj:`scipy.sparse.csc_matrix`): Matrix.
+
+        Returns:
+            (:obj:`scipy.sparse.csc_matrix`)
+        '''
+
+        A = scipy.sparse.csc_matrix(A); A.sum_duplicates()
+
+        if self.pattern is None or A.shape != self.pattern.shape:
+            return A
+
+        keys = numpy.repeat(numpy.arange(A.shape[1], dtype=numpy.int64), numpy.diff(A.indptr)) * A.shape[0] + A.indices
+
+        k = numpy.minimum(numpy.searchsorted(self.pattern_keys, keys), self.pattern_keys.size - 1)
+
+        # Entries out of the pattern, it is not used anymore
+        if numpy.any(self.pattern_keys[k] != keys):
+
+            self.pattern = None
+
+            return A
+
+        data = numpy.zeros(self.pattern_keys.size); data[k] = A.data
+
+        return scipy.sparse.csc_matrix((data, self.pattern.indices, self.pattern.indptr), shape=A.shape)
+
+    def analyze(self, A):
+        ''' Checks if a matrix has the sparsity pattern of the last analyzed one, storing it otherwise.
+
+        Args:
+            A (:obj:`scipy.sparse.csc_matrix`): Matrix in canonical format.
+
+        Returns:
+            (:obj:`bool`): True if the pattern is unchanged, False otherwise.
+        '''
+
+        if self.indptr is None or not numpy.array_equal(self.indptr, A.indptr) or not numpy.array_equal(self.indices, A.indices):
+
+            self.indptr  = A.indptr.copy()
+            self.indices = A.indices.copy()
+
+            # Factorizations with the previous ordering
+            self.cache = []
+
+            return False
+
+        else:
+            return True
+
+    def factorize(self, A, key=None):
+        ''' Computes the factorization of a matrix, unless the one stored has the same key.
+
+        Args:
+            A (:obj:`scipy.sparse.csc_matrix`): Matrix.
+            key (:obj:`tuple`, optional): Key identifying the matrix, if None it is always factorized.
+        '''
+
+        if self.lu is not None and key != None and key == self.key:
+            self.stats.count('reuse')
+
+        else:
+
+            if self.cached(key):
+
+                entry = [entry for entry in self.cache if entry[0] == key][0]
+
+                self.load(entry[1]); self.key = key; self.stats.count('reuse')
+
+            else:
+
+                self.stats.tic('factorization')
+
+                self.lu  = self.decompose(A)
+                self.key = key
+
+                self.stats.toc('factorization'); self.stats.count('factorization')
+
+                if key == None:
+                    return
+
+                entry = (key, self.save())
+
+            # Most recently used first
+            self.cache = [entry] + [other for other in self.cache if other[0] != key]
+
+            del self.cache[self.size:]
+
+    def cached(self, key):
+
+        return key != None and any([entry[0] == key for entry in self.cache])
+
+    def save(self):
+        ''' Returns the data of the stored factorization, kept in :attr:`cache`.
+        '''
+
+        return self.lu, self.permuted
+
+    def load(self, data):
+        ''' Restores the data of a factorization returned by :meth:`save`.
+        '''
+
+        self.lu, self.permuted = data
+
+    def decompose(self, A):
+        ''' Computes the factorization of a matrix.
+
+        With an unchanged pattern the columns are permuted with the stored ordering and factorized in
+        natural order, so the ordering is not computed again.
+        '''
+
+        A = self.canonical(A)
+
+        if self.analyze(A) and self.perm_c is not None:
+
+            self.permuted = True
+
+            return scipy.sparse.linalg.splu(A[:, self.perm_c], permc_spec='NATURAL')
+
+        else:
+
+            lu = scipy.sparse.linalg.splu(A)
+
+            # Columns of A in the order used by SuperLU
+            self.perm_c = numpy.argsort(lu.perm_c); self.permuted = False
+
+            return lu
+
+    def substitute(self, b, trans='N'):
+        ''' Solves a linear system with the stored factorization and a dense right hand side.
+        '''
+
+        if self.permuted:
+
+            if trans == 'T':
+                return self.lu.solve(b[self.perm_c], trans)
+            else:
+                x = numpy.empty_like(b); x[self.perm_c] = self.lu.solve(b, trans)
+
+                return x
+
+        else:
+            return self.lu.solve(b, trans)
+
+    def invalidate(self):
+        ''' Discards the stored factorizations.
+        '''
+
+        self.lu  = None
+        self.key = None
+
+        self.cache = []
+
+    def solve(self, b, trans='N'):
+        ''' Solves a linear system with the stored factorization.
+
+        Args:
+            b (:obj:`numpy.ndarray`): Right hand side, sparse matrices are also accepted.
+            trans (:obj:`str`, optional): 'N' to solve with the matrix, 'T' to solve with its transpose.
+
+        Returns:
+            (:obj:`numpy.ndarray`): Solution, sparse if the right hand side was sparse.
+        '''
+
+        self.stats.tic('solve')
+
+        if scipy.sparse.issparse(b):
+            x = scipy.sparse.csc_matrix(self.substitute(b.toarray(), trans))
+        else:
+            x = self.substitute(b, trans)
+
+        self.stats.toc('solve'); self.stats.count('solve')
+
+        return x
+
+class solver_um(solver_lu):
+    ''' Sparse direct solver using UMFPACK, available if scikit-umfpack is installed.
+
+    The symbolic analysis is kept while the pattern does not change.
+
+    Attributes:
+        umf (:obj:`scikits.umfpack.UmfpackContext`): UMFPACK context holding the symbolic analysis.
+        A (:obj:`scipy.sparse.csc_matrix`): Last factorized matrix.
+    '''
+
+    def __init__(self):
+        solver_lu.__init__(self)
+
+        self.umf = None
+        self.A   = None
+
+    def reset(self, pattern=None):
+        solver_lu.reset(self, pattern); self.umf = None
+
+    def decompose(self, A):
+
+        A = self.canonical(A)
+
+        # The context holds one numeric factorization, so it is only reused if one is kept
+        if self.analyze(A) and self.umf is not None and self.size == 1:
+            pass
+        else:
+
+            if A.indices.dtype == numpy.int32:
+                self.umf = umfpack.UmfpackContext('di')
+            else:
+                self.umf = umfpack.UmfpackContext('dl')
+
+            self.umf.symbolic(A)
+
+        self.umf.numeric(A); self.A = A
+
+        return self.umf
+
+    def save(self):
+        return self.umf, self.A
+
+    def load(self, data):
+        self.umf, self.A = data; self.lu = self.umf
+
+    def substitute(self, b, trans='N'):
+
+        if trans == 'T':
+            system = umfpack.UMFPACK_At
+        else:
+            system = umfpack.UMFPACK_A
+
+        if b.ndim == 1:
+            return self.umf.solve(system, self.A, b, autoTranspose=True)
+        else:
+            return numpy.column_stack([self.umf.solve(system, self.A, b[:, k], autoTranspose=True) for k in range(b.shape[1])])
+
+class solver_ch(solver_lu):
+    ''' Sparse Cholesky solver for symmetric positive definite matrices, available if scikit-sparse is installed.
+
+    A symmetric matrix with positive diagonal, as selected by :func:`select`, may still be indefinite.
+    Then the matrices of the problem are factorized by SuperLU instead, see :class:`solver_lu`.
+
+    Attributes:
+        spd (:obj:`bool`): True while the matrices are positive definite, False once one is not.
+    '''
+
+    def __init__(self):
+        solver_lu.__init__(self)
+
+        self.spd = True
+
+    def reset(self, pattern=None):
+        solver_lu.reset(self, pattern); self.spd = True
+
+    def decompose(self, A):
+
+        if self.spd:
+
+            A = self.canonical(A)
+
+            # The symbolic factorization is kept while the pattern does not change
+            if self.analyze(A) and self.lu is not None:
+
+                # Factorizations kept are not overwritten
+                if self.size == 1:
+                    factor = self.lu
+                else:
+                    factor = self.lu.copy()
+
+            else:
+                factor = cholmod.analyze(A)
+
+            try:
+                factor.cholesky_inplace(A)
+
+                return factor
+
+            except cholmod.CholmodNotPositiveDefiniteError:
+
+                self.spd = False; self.lu = None; self.cache = []
+
+                self.stats.count('cholesky failure')
+
+        return solver_lu.decompose(self, A)
+
+    def substitute(self, b, trans='N'):
+
+        if self.spd:
+            return self.lu(b)
+        else:
+            return solver_lu.substitute(self, b, trans)
+
+class solver_dn(solver_lu):
+    ''' Dense solver using LAPACK, Cholesky for symmetric positive definite matrices and LU otherwise.
+
+    Attributes:
+        spd (:obj:`bool`): True if the matrices are symmetric positive definite, False otherwise.
+    '''
+
+    def __init__(self, spd=False):
+        solver_lu.__init__(self)
+
+        self.spd = spd
+
+    def decompose(self, A):
+
+        A = to_dense(A)
+
+        if self.spd:
+
+            try:
+                return 'cho', scipy.linalg.cho_factor(A)
+            except numpy.linalg.LinAlgError:
+                self.spd = False
+
+        return 'lu', scipy.linalg.lu_factor(A)
+
+    def substitute(self, b, trans='N'):
+
+        kind, factors = self.lu
+
+        if kind == 'cho':
+            return scipy.linalg.cho_solve(factors, b)
+        else:
+            if trans == 'T':
+                return scipy.linalg.lu_solve(factors, b, trans=1)
+            else:
+                return scipy.linalg.lu_solve(factors, b)
+
+class solver_au(solver_ls):
+    ''' Solver selecting a backend from :data:`backends` the first time a matrix is factorized.
+
+    The choice, made by :func:`select` from the size, the sparsity and the symmetry of the matrix, is
+    kept until :meth:`reset` is called, so it is done once per problem.
+
+    Attributes:
+        precond (:obj:`str`): Preconditioner used if an iterative backend is selected.
+        name (:obj:`str`): Name of the selected backend, None if not selected yet.
+        backend (:obj:`solver_ls`): Selected backend.
+        size (:obj:`int`): Number of factorizations kept by the backend, see :class:`solver_lu`.
+    '''
+
+    def __init__(self, precond='ilu'):
+        solver_ls.__init__(self)
+
+        self.precond = precond
+
+        self.name    = None
+        self.backend = None
+
+        self.pattern = None
+
+        self.size = 1
+
+    def attach(self, stats):
+
+        self.stats = stats
+
+        if self.backend == None:
+            pass
+        else:
+            self.backend.attach(stats)
+
+    def reset(self, pattern=None):
+        ''' Forgets the selected backend.
+
+        Args:
+            pattern (:obj:`scipy.sparse.csc_matrix`, optional): Sparsity pattern of the matrices of the new problem.
+        '''
+
+        self.name    = None
+        self.backend = None
+
+        self.pattern = pattern
+
+    def renew(self):
+
+        if self.backend == None:
+            pass
+        else:
+            self.backend.renew()
+
+    def factorize(self, A, key=None):
+
+        if self.backend == None:
+
+            self.name = select(A)
+
+            self.backend = build(self.name, self.precond); self.backend.attach(self.stats); self.backend.reset(self.pattern)
+
+            self.backend.size = self.size
+
+        self.backend.factorize(A, key)
+
+    def invalidate(self):
+
+        if self.backend == None:
+            pass
+        else:
+            self.backend.invalidate()
+
+    def cached(self, key):
+
+        if self.backend == None:
+            return False
+        else:
+            return self.backend.cached(key)
+
+    def solve(self, b, trans='N'):
+
+        x = self.backend.solve(b, trans); self.failed = self.backend.failed
+
+        return x
+
+class solver_kr(solver_ls):
+    ''' Iterative solver using a preconditioned Krylov method.
+
+    It shares the interface of :class:`solver_lu`, :meth:`factorize` only stores the matrix and updates
+    the preconditioner when this one needs to be built again, see :class:`precond`.
+
+    Attributes:
+        method (:obj:`str`): Krylov method, 'gmres' or 'bicgstab'.
+        precond (:obj:`precond`): Preconditioner, None if not preconditioned.
+        r_tol (:obj:`float`): Relative tolerance on the residual.
+        l_ite (:obj:`int`): Maximum number of iterations.
+    '''
+
+    def __init__(self, method='gmres', precond=None, r_tol=1e-10, l_ite=200):
+        solver_ls.__init__(self)
+
+        self.method  = method
+        self.precond = precond
+
+        self.r_tol = r_tol
+        self.l_ite = l_ite
+
+        self.A   = None
+        self.key = None
+
+    def factorize(self, A, key=None):
+        ''' Stores a matrix and builds the preconditioner if required.
+
+        Args:
+            A (:obj:`scipy.sparse.csc_matrix`): Matrix.
+            key (:obj:`tuple`, optional): Key identifying the matrix, if None it is always stored.
+        '''
+
+        if self.A is None or key == None or key != self.key:
+
+            self.A   = scipy.sparse.csc_matrix(A)
+            self.key = key
+
+            if self.precond == None:
+                pass
+            else:
+
+                if self.precond.ready:
+                    pass
+                else:
+                    self.stats.count('preconditioner')
+
+                self.precond.update(self.A)
+
+        else:
+            self.stats.count('reuse')
+
+    def invalidate(self):
+        ''' Discards the stored matrix.
+        '''
+
+        self.A   = None
+        self.key = None
+
+    def renew(self):
+        ''' Ages the preconditioner, see :meth:`precond.renew`.
+        '''
+
+        if self.precond == None:
+            pass
+        else:
+            self.precond.renew()
+
+    def solve(self, b, trans='N'):
+        ''' Solves a linear system with the stored matrix.
+
+        If the tolerance is not reached within :attr:`l_ite` iterations, :attr:`failed` is set and the
+        failure is counted as 'krylov failure'.
+
+        Args:
+            b (:obj:`numpy.ndarray`): Right hand side, sparse matrices are also accepted.
+            trans (:obj:`str`, optional): 'N' to solve with the matrix, 'T' to solve with its transpose.
+
+        Returns:
+            (:obj:`numpy.ndarray`): Solution, sparse if the right hand side was sparse.
+        '''
+
+        if scipy.sparse.issparse(b):
+
+            x = numpy.zeros(b.shape); failed = False
+
+            for j in range(b.shape[1]):
+                x[:, j] = self.solve(b[:, j].toarray().ravel(), trans); failed = failed or self.failed
+
+            self.failed = failed
+
+            return scipy.sparse.csc_matrix(x)
+
+        if trans == 'T':
+            A = self.A.transpose()
+        else:
+            A = self.A
+
+        if self.precond == None:
+            M = None
+        else:
+            M = self.precond.operator(trans)
+
+        self.stats.tic('solve')
+
+        x, info = krylov(A, b, self.method, self.r_tol, M, maxiter=self.l_ite)
+
+        self.stats.toc('solve'); self.stats.count('solve')
+
+        self.failed = info != 0
+
+        if self.failed:
+            self.stats.count('krylov failure')
+
+        return x
+
+class precond(object):
+    ''' Abstract class for a preconditioner.
+
+    A preconditioner is built from a matrix by :meth:`update` and then reused, across stages and Newton
+    iterations, until it has been used during :attr:`lifetime` steps. The solvers call :meth:`renew` once
+    per step.
+
+    .. inheritance-diagram:: precond_ilu precond_jac precond_lu
+       :parts: 1
+
+    Attributes:
+        lifetime (:obj:`int`): Number of steps the preconditioner is kept.
+        age (:obj:`int`): Number of steps since the preconditioner was built.
+        ready (:obj:`bool`): True if the preconditioner can be used, False if it must be built again.
+    '''
+
+    def __init__(self, lifetime=1):
+
+        self.lifetime = lifetime
+
+        self.age   = 0
+        self.ready = False
+
+    def renew(self):
+        ''' Starts a new step, marking the preconditioner to be built again if it is too old.
+        '''
+
+        self.age = self.age + 1
+
+        if self.age >= self.lifetime:
+            self.ready = False
+
+    def update(self, A):
+        ''' Builds the preconditioner from a matrix, unless the stored one can still be used.
+
+        Args:
+            A (:obj:`scipy.sparse.csc_matrix`): Matrix.
+        '''
+
+        if self.ready:
+            pass
+        else:
+
+            self.setup(scipy.sparse.csc_matrix(A))
+
+            self.age = 0; self.ready = True
+
+    def setup(self, A):
+        ''' Builds the preconditioner from a matrix.
+        '''
+        pass
+
+    def apply(self, b, trans='N'):
+        ''' Applies the preconditioner, approximating the solution of a linear system.
+        '''
+        pass
+
+    def operator(self, trans='N'):
+        ''' Returns the preconditioner as a linear operator.
+
+        Args:
+            trans (:obj:`str`, optional): 'N' to approximate the matrix inverse, 'T' to approximate its transpose.
+
+        Returns:
+            (:obj:`scipy.sparse.linalg.LinearOperator`)
+        '''
+
+        return scipy.sparse.linalg.LinearOperator(self.shape, matvec=lambda b: self.apply(b, trans), dtype=float)
+
+class precond_ilu(precond):
+    ''' Incomplete LU preconditioner, see :func:`scipy.sparse.linalg.spilu`.
+
+    Attributes:
+        drop_tol (:obj:`float`): Drop tolerance.
+        fill_factor (:obj:`float`): Maximum fill ratio with respect to the matrix.
+    '''
+
+    def __init__(self, lifetime=1, drop_tol=1e-4, fill_factor=10):
+
+        precond.__init__(self, lifetime)
+
+        self.drop_tol    = drop_tol
+        self.fill_factor = fill_factor
+
+    def setup(self, A):
+
+        self.shape = A.shape
+
+        self.ilu = scipy.sparse.linalg.spilu(A, drop_tol=self.drop_tol, fill_factor=self.fill_factor)
+
+    def apply(self, b, trans='N'):
+        return self.ilu.solve(b, trans)
+
+class precond_jac(precond):
+    ''' Jacobi or block Jacobi preconditioner.
+
+    The diagonal blocks of size :attr:`block` are inverted, a size 1 gives the Jacobi preconditioner.
+    Zero diagonal entries, as in the algebraic rows of :math:`M - h\\gamma J` for DAEs, are replaced by
+    one, and singular blocks by their diagonal, so the preconditioner stays finite.
+
+    Attributes:
+        block (:obj:`int`): Size of the diagonal blocks.
+    '''
+
+    def __init__(self, lifetime=1, block=1):
+
+        precond.__init__(self, lifetime)
+
+        self.block = block
+
+    def setup(self, A):
+
+        self.shape = A.shape
+
+        n = A.shape[0]; m = self.block
+
+        if m == 1:
+            self.D = 1.0 / numpy.where(A.diagonal() == 0., 1.0, A.diagonal())
+        else:
+
+            # Diagonal blocks, padded with the identity up to a multiple of the block size
+            nb = - (- n // m)
+
+            D = numpy.zeros((nb, m, m)); r = numpy.arange(n, nb * m)
+
+            D[r // m, r % m, r % m] = 1.0
+
+            C = A.tocoo(); inside = C.row // m == C.col // m
+
+            D[C.row[inside] // m, C.row[inside] % m, C.col[inside] % m] = C.data[inside]
+
+            # Singular blocks are reduced to their diagonal
+            singular = numpy.linalg.matrix_rank(D) < m
+
+            if singular.any():
+
+                d = numpy.diagonal(D[singular], axis1=1, axis2=2)
+
+                D[singular] = numpy.eye(m) * numpy.where(d == 0., 1.0, d)[:, :, None]
+
+            self.D = numpy.linalg.inv(D)
+
+    def apply(self, b, trans='N'):
+
+        if self.block == 1:
+            return self.D * b
+
+        n = b.size; m = self.block; nb = self.D.shape[0]
+
+        y = numpy.zeros(nb * m); y[:n] = b; y = y.reshape(nb, m, 1)
+
+        if trans == 'T':
+            y = numpy.matmul(numpy.transpose(self.D, (0, 2, 1)), y)
+        else:
+            y = numpy.matmul(self.D, y)
+
+        return y.ravel()[:n]
+
+class precond_lu(precond):
+    ''' Preconditioner given by the complete factorization of an older matrix.
+
+    It is meant to be kept for several steps, for example the factorization of an iteration matrix
+    :math:`M - h\\gamma J` used while :math:`h` and :math:`J` change.
+    '''
+
+    def __init__(self, lifetime=10):
+
+        precond.__init__(self, lifetime)
+
+    def setup(self, A):
+
+        self.shape = A.shape
+
+        self.lu = scipy.sparse.linalg.splu(A)
+
+    def apply(self, b, trans='N'):
+        return self.lu.solve(b, trans)
+
+preconds = {'ilu': precond_ilu, 'jacobi': precond_jac, 'lu': precond_lu}
+
+backends = {'superlu': solver_lu, 'dense': solver_dn, 'krylov': solver_kr}
+
+if umfpack == None:
+    pass
+else:
+    backends['umfpack'] = solver_um
+
+if cholmod == None:
+    pass
+else:
+    backends['cholesky'] = solver_ch
+
+def select(A, n_dense=100, n_krylov=500000, density=0.1):
+    ''' Selects a backend for a matrix.
+
+    Small or dense matrices are solved with LAPACK, very large ones with a preconditioned Krylov method,
+    symmetric ones with positive diagonal with Cholesky and the remaining ones with UMFPACK or SuperLU,
+    depending on the available backends.
+
+    Args:
+        A (:obj:`scipy.sparse.csc_matrix`): Matrix.
+        n_dense (:obj:`int`, optional): Size under which the dense backend is selected.
+        n_krylov (:obj:`int`, optional): Size over which the iterative backend is selected.
+        density (:obj:`float`, optional): Ratio of non-zeros over which the dense backend is selected.
+
+    Returns:
+        (:obj:`str`): Name of the backend in :data:`backends`.
+    '''
+
+    n = A.shape[0]
+
+    if scipy.sparse.issparse(A):
+        nnz = A.nnz
+    else:
+        nnz = n * n
+
+    if n <= n_dense or nnz > density * n * n:
+        return 'dense'
+
+    if n >= n_krylov:
+        return 'krylov'
+
+    A = scipy.sparse.csc_matrix(A)
+
+    if 'cholesky' in backends and numpy.all(A.diagonal() > 0.):
+
+        if abs(A - A.transpose()).max() <= 1e-12 * abs(A).max():
+            return 'cholesky'
+
+    if 'umfpack' in backends:
+        return 'umfpack'
+    else:
+        return 'superlu'
+
+def build(name='auto', precond=None):
+    ''' Instances a linear solver from the name of a backend.
+
+    Args:
+        name (:obj:`str`, optional): 'auto' or a name in :data:`backends`.
+        precond (:obj:`str`, optional): Preconditioner of the iterative backend, a name in :data:`preconds`.
+
+    Returns:
+        (:obj:`solver_ls`)
+    '''
+
+    if name == 'auto':
+        if precond == None:
+            return solver_au()
+        else:
+            return solver_au(precond)
+
+    if name in backends:
+        pass
+    else:
+        raise NameError('Unknown linear solver or backend not installed...')
+
+    if name == 'krylov':
+        if precond == None:
+            return solver_kr(precond=precond_ilu())
+        else:
+            return solver_kr(precond=preconds[precond]())
+    else:
+        return backends[name]()
@@ -0,0 +1,99 @@
+
+# Basic modules
+from fatDAE.base.basic_import import *
+
+class stats(object):
+    ''' Statistics of the non-linear and linear solvers along one resolution.
+
+    The solvers record in it the work done, the drivers :meth:`fatDAE.class_solvers.RK.solve_fxd` and
+    :meth:`fatDAE.class_solvers.RK.solve_adp` share one instance among all of them, see
+    :meth:`fatDAE.class_solvers.RK.attach`, so it aggregates the whole resolution.
+
+    Attributes:
+        counters (:obj:`dict`): Number of events by name, as 'jacobian', 'factorization' or 'solve'.
+        timers (:obj:`dict`): Wall time in seconds by phase.
+        iterations (:obj:`list`): Newton iterations of each stage.
+        residuals (:obj:`list`): Residual history of each stage.
+    '''
+
+    def __init__(self):
+        self.clean()
+
+    def clean(self):
+        ''' Erases all the recorded data.
+        '''
+
+        self.counters = {}
+        self.timers   = {}
+
+        self.started = {}
+
+        self.iterations = []
+        self.residuals  = []
+
+    def count(self, name, n=1):
+        ''' Increases a counter.
+
+        Args:
+            name (:obj:`str`): Name of the counter.
+            n (:obj:`int`, optional): Increment.
+        '''
+
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def tic(self, name):
+        ''' Starts the timer of a phase.
+
+        Args:
+            name (:obj:`str`): Name of the phase.
+        '''
+
+        self.started[name] = time.time()
+
+    def toc(self, name):
+        ''' Stops the timer of a phase, adding the elapsed time since :meth:`tic`.
+
+        Args:
+            name (:obj:`str`): Name of the phase.
+        '''
+
+        self.timers[name] = self.timers.get(name, 0.) + time.time() - self.started.pop(name)
+
+    def record(self, residuals):
+        ''' Records the residual history of one stage, and so its number of iterations.
+
+        Args:
+            residuals (:obj:`list`): Residuals of the iterations.
+        '''
+
+        self.iterations.append(len(residuals))
+        self.residuals.append(residuals)
+
+    def merge(self, other):
+        ''' Adds the data recorded by other instance.
+
+        Args:
+            other (:obj:`stats`)
+        '''
+
+        for name in other.counters:
+            self.count(name, other.counters[name])
+
+        for name in other.timers:
+            self.timers[name] = self.timers.get(name, 0.) + other.timers[name]
+
+        self.iterations = self.iterations + other.iterations
+        self.residuals  = self.residuals  + other.residuals
+
+    def report(self):
+        ''' Prints a summary of the recorded data.
+        '''
+
+        for name in sorted(self.counters):
+            print('%-16s %d' % (name, self.counters[name]))
+
+        if len(self.iterations) > 0:
+            print('%-16s %.2f (max. %d)' % ('newton/stage', numpy.mean(self.iterations), max(self.iterations)))
+
+        for name in sorted(self.timers):
+            print('%-16s %.3f s' % (name, self.timers[name]))
@@ -0,0 +1,335 @@
+
+# Basic modules
+from fatDAE.base.basic_import import *
+
+import hashlib
+
+try:
+    from sympy.printing.numpy import NumPyPrinter
+except ImportError:
+    from sympy.printing.pycode import NumPyPrinter
+
+def generate(name, args, exprs):
+    ''' Generates the source of a function evaluating a list of expressions.
+
+    Common subexpressions are computed once.
+
+    Args:
+        name (:obj:`str`): Name of the function.
+        args (:obj:`list`): Arguments, :obj:`sympy.Symbol`.
+        exprs (:obj:`list`): Expressions.
+
+    Returns:
+        (:obj:`str`): Source of the function, returning the list of values.
+    '''
+
+    printer = NumPyPrinter()
+
+    replacements, reduced = sympy.cse(exprs, symbols=sympy.numbered_symbols('c_'))
+
+    lines = ['def %s(%s):' % (name, ', '.join([str(a) for a in args]))]
+
+    for symbol, expr in replacements:
+        lines.append('    %s = %s' % (symbol, printer.doprint(expr)))
+
+    lines.append('    return [%s]' % ', '.join([printer.doprint(expr) for expr in reduced]))
+
+    return '\n'.join(lines) + '\n'
+
+def generate_matrix(name, args, A):
+    ''' Generates the source of a function evaluating the non-zeros of a matrix.
+
+    The rows and columns of the non-zeros are stored in the variables ``name_rows`` and ``name_cols``.
+
+    Args:
+        name (:obj:`str`): Name of the function.
+        args (:obj:`list`): Arguments, :obj:`sympy.Symbol`.
+        A (:obj:`sympy.Matrix`): Matrix.
+
+    Returns:
+        (:obj:`str`): Source of the function.
+    '''
+
+    rows = []
+    cols = []
+
+    exprs = []
+
+    for i in range(A.rows):
+        for j in range(A.cols):
+
+            if A[i, j] == 0:
+                pass
+            else:
+                rows.append(i); cols.append(j); exprs.append(A[i, j])
+
+    return '%s_rows = %s\n%s_cols = %s\n%s_shape = (%d, %d)\n' % (name, rows, name, cols, name, A.rows, A.cols) + generate(name, args, exprs)
+
+class compiler(object):
+    ''' Compiler of a symbolic problem into numerical functions.
+
+    All the derivatives required by the forward, tangent and adjoint resolutions are computed by
+    :mod:`sympy` and translated into NumPy code, vectors are returned as :obj:`numpy.ndarray` and matrices
+    as :obj:`scipy.sparse.csc_matrix` assembled from their symbolic non-zeros. The source is cached on
+    disk, keyed by the symbolic problem, so later runs skip the differentiation.
+
+    Attributes:
+        n (:obj:`int`): Dimension of the state.
+        p (:obj:`int`): Dimension of the control.
+        M_constant (:obj:`bool`): True if the matrix is constant, False otherwise.
+        linear (:obj:`bool`): True if the problem is linear, see :meth:`fatDAE.class_problem.Problem.detect_linear`.
+        u (:obj:`numpy.ndarray`): Values of the control, it can be modified in place.
+        source (:obj:`str`): Generated source.
+        module (:obj:`dict`): Namespace with the generated functions.
+    '''
+
+    def __init__(self, t, x, f, M=None, u=None, u_0=None, J=None, g=None, params={}, cache='~/.cache/fatDAE'):
+        ''' Compiles a symbolic problem.
+
+        Args:
+            t (:obj:`sympy.Symbol`): Time.
+            x (:obj:`list`): State, :obj:`sympy.Symbol`.
+            f (:obj:`sympy.Matrix`): Source.
+            M (:obj:`sympy.Matrix`, optional): Matrix, the identity if not given.
+            u (:obj:`list`, optional): Control, :obj:`sympy.Symbol`.
+            u_0 (:obj:`numpy.ndarray`, optional): Values of the control.
+            J (:obj:`sympy.Expr`, optional): Final cost.
+            g (:obj:`sympy.Expr`, optional): Running cost.
+            params (:obj:`dict`, optional): Values of other symbols.
+            cache (:obj:`str`, optional): Directory of the cache, None to disable it.
+        '''
+
+        self.n = len(x)
+
+        if u is None:
+            u = []
+
+        self.p = len(u)
+
+        if u_0 is None:
+            self.u = numpy.zeros(self.p)
+        else:
+            self.u = numpy.array(u_0, dtype=float)
+
+        # Symbols with valid names
+        T = sympy.Symbol('t_')
+        X = sympy.symbols('x_0:%d' % self.n)
+        Y = sympy.symbols('y_0:%d' % self.n)
+        U = sympy.symbols('u_0:%d' % self.p)
+
+        subs = dict(zip([t] + list(x) + list(u), [T] + list(X) + list(U)))
+
+        subs.update(params)
+
+        f = sympy.Matrix(f).subs(subs)
+
+        if M == None:
+            M = sympy.eye(self.n)
+        else:
+            M = sympy.Matrix(M).subs(subs)
+
+        if J == None:
+            pass
+        else:
+            J = sympy.sympify(J).subs(subs)
+
+        if g == None:
+            pass
+        else:
+            g = sympy.sympify(g).subs(subs)
+
+        self.M_constant = M.free_symbols.isdisjoint(set([T] + list(X)))
+
+        self.linear = self.M_constant and f.jacobian(X).free_symbols.isdisjoint(set([T] + list(X)))
+
+        key = hashlib.sha1((sympy.__version__ + sympy.srepr([f, M, J, g, self.n, self.p])).encode()).hexdigest()
+
+        if cache == None:
+            path = None
+        else:
+            path = os.path.join(os.path.expanduser(cache), 'symbolic_' + key + '.py')
+
+        if path != None and os.path.isfile(path):
+
+            with open(path) as source_file:
+                self.source = source_file.read()
+
+        else:
+
+            self.source = self.build(T, X, Y, U, f, M, J, g)
+
+            if path == None:
+                pass
+            else:
+
+                if os.path.isdir(os.path.dirname(path)):
+                    pass
+                else:
+                    os.makedirs(os.path.dirname(path))
+
+                with open(path, 'w') as source_file:
+                    source_file.write(self.source)
+
+        self.module = {'numpy': numpy}
+
+        exec(compile(self.source, '<fatDAE.symbolic %s>' % key, 'exec'), self.module)
+
+    def build(self, T, X, Y, U, f, M, J, g):
+        ''' Computes the derivatives and generates the source of all the functions.
+        '''
+
+        x_args = [T] + list(X) + list(U)
+        y_args = [T] + list(X) + list(Y) + list(U)
+
+        y = sympy.Matrix(Y)
+
+        dfdx = f.jacobian(X)
+
+        source = ['import numpy\n']
+
+        source.append(generate('f', x_args, list(f)))
+        source.append(generate('dfdt', x_args, list(f.diff(T))))
+
+        source.append(generate_matrix('dfdx', x_args, dfdx))
+        source.append(generate_matrix('d2fdxdt', x_args, dfdx.diff(T)))
+        source.append(generate_matrix('d2fdxdx', y_args, (dfdx * y).jacobian(X)))
+
+        source.append(generate_matrix('M', x_args, M))
+        source.append(generate_matrix('dMdt', x_args, M.diff(T)))
+        source.append(generate_matrix('dMdx', y_args, sympy.Matrix(M.rows, M.cols, lambda i, j: sum([M[i, j].diff(X[k]) * Y[k] for k in range(self.n)]))))
+
+        if self.p > 0:
+
+            dfdu = f.jacobian(U)
+
+            source.append(generate_matrix('dfdu', x_args, dfdu))
+            source.append(generate_matrix('d2fdtdu', x_args, dfdu.diff(T)))
+            source.append(generate_matrix('d2fdxdu', y_args, (dfdx * y).jacobian(U)))
+            source.append(generate_matrix('dMdu', y_args, (M * y).jacobian(U)))
+
+        for name, cost in [('J', J), ('g', g)]:
+
+            if cost == None:
+                pass
+            else:
+
+                source.append(generate(name, x_args, [cost]))
+                source.append(generate('d%sdx' % name, x_args, [cost.diff(X[k]) for k in range(self.n)]))
+                source.append(generate('d%sdu' % name, x_args, [cost.diff(U[k]) for k in range(self.p)]))
+
+        return '\n'.join(source)
+
+    def vector(self, name):
+        ''' Builds a function of time and state returning a vector.
+
+        The function also accepts an array of times and a block of states by columns, see
+        :class:`fatDAE.class_problem.Problem`.
+        '''
+
+        raw = self.module[name]
+
+        def function(t, x):
+
+            if numpy.ndim(x) == 1:
+                return numpy.array(raw(t, *(list(x) + list(self.u))), dtype=float)
+            else:
+
+                zero = numpy.zeros(numpy.shape(x)[1])
+
+                return numpy.array([value + zero for value in raw(t, *(list(x) + list(self.u)))], dtype=float)
+
+        return function
+
+    def scalar(self, name):
+        ''' Builds a function of time and state returning a scalar.
+        '''
+
+        raw = self.module[name]
+
+        def function(t, x):
+            return float(raw(t, *(list(x) + list(self.u)))[0])
+
+        return function
+
+    def matrix(self, name, direction=False):
+        ''' Builds a function of time and state, and a direction if required, returning a sparse matrix.
+
+        Without direction, the function also accepts an array of times and a block of states by
+        columns, returning the list of matrices.
+        '''
+
+        raw = self.module[name]
+
+        rows  = self.module[name + '_rows']
+        cols  = self.module[name + '_cols']
+        shape = self.module[name + '_shape']
+
+        def assemble(values):
+            return scipy.sparse.csc_matrix((numpy.array(values, dtype=float).reshape(-1), (rows, cols)), shape=shape)
+
+        if direction:
+
+            def function(t, x, y):
+                return assemble(raw(t, *(list(x) + list(y) + list(self.u))))
+
+        else:
+
+            def function(t, x):
+
+                if numpy.ndim(x) == 1:
+                    return assemble(raw(t, *(list(x) + list(self.u))))
+                else:
+                    return [function(numpy.broadcast_to(t, numpy.shape(x)[1])[k], x[:, k]) for k in range(numpy.shape(x)[1])]
+
+        return function
+
+    def pattern(self, name):
+        ''' Returns the sparsity pattern of a matrix, given by its symbolic non-zeros.
+        '''
+
+        rows = self.module[name + '_rows']
+        cols = self.module[name + '_cols']
+
+        return scipy.sparse.csc_matrix((numpy.ones(len(rows), dtype=bool), (rows, cols)), shape=self.module[name + '_shape'], dtype=bool)
+
+    def problem(self):
+        ''' Returns the matrix, the source and the dictionary of derivatives expected by :class:`fatDAE.class_problem.Problem`.
+
+        Returns:
+            (tuple): Tuple containing:
+
+            - **M** (:obj:`function`): Matrix, a :obj:`scipy.sparse.csc_matrix` if constant.
+            - **f** (:obj:`function`): Source.
+            - **derivatives** (:obj:`dict`): Derivatives.
+        '''
+
+        if self.M_constant:
+            M = self.matrix('M')(0., numpy.zeros(self.n))
+        else:
+            M = self.matrix('M')
+
+        derivatives = {'dfdx': self.matrix('dfdx'), 'dfdt': self.vector('dfdt'), 'd2fdxdt': self.matrix('d2fdxdt'), 'd2fdxdx': self.matrix('d2fdxdx', True)}
+
+        if self.M_constant:
+            pass
+        else:
+            derivatives['dMdx'] = self.matrix('dMdx', True)
+            derivatives['dMdt'] = self.matrix('dMdt')
+
+        if self.p > 0:
+
+            derivatives['dfdu'] = self.matrix('dfdu')
+            derivatives['d2fdtdu'] = self.matrix('d2fdtdu')
+            derivatives['d2fdxdu'] = self.matrix('d2fdxdu', True)
+            derivatives['dMdu'] = self.matrix('dMdu', True)
+
+        for name in ['J', 'g']:
+
+            if name in self.module:
+
+                derivatives['d%sdx' % name] = self.vector('d%sdx' % name)
+                derivatives['d%sdu' % name] = self.vector('d%sdu' % name)
+
+        derivatives['pattern'] = self.pattern('dfdx')
+
+        return M, self.vector('f'), derivatives
@@ -41,10 +41,22 @@ class Butcher(object):
 
         known as row condition.
 
+    .. note::
+        The coefficients of a continuous extension can be given in the optional keys 'B_1' and 'B_2',
+        as a matrix :math:`B\\in\\mathbb{R}^{s\\times m}` defining the polynomials
+
+        .. math::
+            \\begin{equation}
+                b_i(\\theta) = \\sum_{k=1}^{m}B_{ik}\\theta^k, \\quad i=1,\\dots, s
+            \\end{equation}
+
+        with :math:`b_i(1) = b_i`, see :meth:`fatDAE.class_solvers.RK.interpolate`.
+
     Attributes:
         A (:obj:`numpy.ndarray`): Matrix of coefficients, dimension :attr:`s` x :attr:`s`.
         b (:obj:`numpy.ndarray`): Vector of coefficients, dimension :attr:`s`.
         c (:obj:`numpy.ndarray`): Vector of coefficients, dimension :attr:`s`.
+        B (:obj:`numpy.ndarray`): Matrix of coefficients of the continuous extension, None if not given.
         p (:obj:`int`): Order of the method.
         s (:obj:`int`): Stages of the method.
     '''
@@ -68,6 +80,14 @@ class Butcher(object):
             self.b = numpy.array(eval(json["b_1"]))
             self.p = json["p_1"]
 
+        if embedded == True and "B_2" in json:
+            self.B = numpy.array(eval(json["B_2"]))
+        else:
+            if embedded == False and "B_1" in json:
+                self.B = numpy.array(eval(json["B_1"]))
+            else:
+                self.B = None
+
         self.s = self.c.size
 
     def P(self, z):
@@ -8,6 +8,9 @@ import sys; sys.path.insert(0,'..'); from fatDAE.base.basic_import import *
 import fatDAE.class_butcher
 import fatDAE.class_solvers
 
+import fatDAE.base.class_derivatives
+import fatDAE.base.class_symbolic
+
 class Problem(object):
     ''' Initial value problem goberned by a quasi-linearly implicit differential-algebraic system.
 
@@ -24,6 +27,8 @@ class Problem(object):
         t_0 (:obj:`int`)
         t_f (:obj:`int`)
         derivatives (:obj:`dict`, optional)
+        vectorized (:obj:`bool`, optional)
+        linear (:obj:`bool`, optional): True if declared linear, None to detect it, see :meth:`detect_linear`.
 
     Attributes:
         M (:obj:`function`)
@@ -36,6 +41,12 @@ class Problem(object):
         dMdt (:obj:`function`, optional)
         dfdx (:obj:`function`, optional)
         dfdt (:obj:`function`, optional)
+        pattern (:obj:`scipy.sparse.csc_matrix`, optional): Sparsity pattern of :attr:`dfdx`, used to compute it by finite differences.
+        pattern_M (:obj:`scipy.sparse.csc_matrix`, optional): Sparsity pattern of :attr:`M`.
+        vectorized (:obj:`bool`): True if :attr:`f` and :attr:`M` accept blocks of times and states, False otherwise.
+        linear (:obj:`bool`): True if :attr:`M` is constant and :attr:`f` is affine in the state with a constant jacobian, False otherwise.
+        affine (:obj:`dict`): Affine decomposition of :attr:`f`, None if not given, see :meth:`from_affine`.
+        t_eval (:obj:`numpy.ndarray`): Output times of the last resolution, None if every step is stored, see :meth:`solve`.
         t_list (:obj:`list`)
         x_list (:obj:`list`)
 
@@ -48,13 +59,25 @@ class Problem(object):
             \\end{equation}
 
         is constant, then :attr:`M` must be a :obj:`scipy.sparse.csc_matrix` instead of a :obj:`function` in order to save matrix evaluations.
+
+    .. note::
+        If :attr:`vectorized` = True, then :attr:`f` must also accept an array of :math:`m` times and a
+        :math:`d\\times m` array of states, returning the :math:`d\\times m` array of values, and :attr:`M`,
+        if it is a :obj:`function`, the list of the :math:`m` matrices. Derivatives by finite differences
+        are then computed with one call.
+
+    .. note::
+        If :attr:`linear` = True, then every stage of the implicit solvers is one linear system, solved
+        without Newton iterations.
     '''
 
-    def update(self, M, f, x_0, t_0, t_f, derivatives={}):
+    def update(self, M, f, x_0, t_0, t_f, derivatives={}, vectorized=False, linear=False):
 
         self.M = M
         self.f = f
 
+        self.vectorized = vectorized
+
         self.x_0 = x_0
         self.t_0 = t_0
         self.t_f = t_f
@@ -79,11 +102,31 @@ class Problem(object):
         else:
             self.dfdt = None
 
-    def __init__(self, M, f, x_0, t_0, t_f, derivatives={}):
+        if 'pattern' in derivatives:
+            self.pattern = derivatives['pattern']
+        else:
+            self.pattern = None
+
+        self.pattern_M = None
+
+        if linear == None:
+            self.linear = self.detect_linear()
+        else:
+
+            if linear and callable(self.M):
+                raise NameError('Linear problems require a constant matrix...')
+
+            self.linear = linear
+
+        self.affine = None
+
+    def __init__(self, M, f, x_0, t_0, t_f, derivatives={}, vectorized=False, linear=False):
 
         self.M = M
         self.f = f
 
+        self.vectorized = vectorized
+
         self.x_0 = x_0
         self.t_0 = t_0
         self.t_f = t_f
@@ -108,6 +151,26 @@ class Problem(object):
         else:
             self.dfdt = None
 
+        if 'pattern' in derivatives:
+            self.pattern = derivatives['pattern']
+        else:
+            self.pattern = None
+
+        self.pattern_M = None
+
+        if linear == None:
+            self.linear = self.detect_linear()
+        else:
+
+            if linear and callable(self.M):
+                raise NameError('Linear problems require a constant matrix...')
+
+            self.linear = linear
+
+        self.affine = None
+
+        self.t_eval = None
+
         self.t_list = []
         self.x_list = []
 
@@ -117,18 +180,260 @@ class Problem(object):
         self.err_est_list = []
         self.err_exc_list = []
 
-    def solve(self, solver, state_machine=None, h=None, adp=False, adj=False, tlm=False):
+    @classmethod
+    def from_symbolic(cls, t, x, f, x_0, t_0, t_f, M=None, u=None, u_0=None, J=None, g=None, params={}, cache='~/.cache/fatDAE'):
+        ''' Instances a problem from symbolic expressions.
+
+        Every derivative is computed symbolically and compiled into vectorized NumPy functions, see
+        :class:`fatDAE.base.class_symbolic.compiler`, and the sparsity patterns are known without detection.
+
+        Args:
+            t (:obj:`sympy.Symbol`): Time.
+            x (:obj:`list`): State, :obj:`sympy.Symbol`.
+            f (:obj:`sympy.Matrix`): Source.
+            x_0 (:obj:`numpy.ndarray`)
+            t_0 (:obj:`int`)
+            t_f (:obj:`int`)
+            M (:obj:`sympy.Matrix`, optional): Matrix, the identity if not given.
+            u (:obj:`list`, optional): Control, :obj:`sympy.Symbol`.
+            u_0 (:obj:`numpy.ndarray`, optional): Values of the control, stored in :attr:`u`.
+            J (:obj:`sympy.Expr`, optional): Final cost, only for :class:`Control`.
+            g (:obj:`sympy.Expr`, optional): Running cost, only for :class:`Control`.
+            params (:obj:`dict`, optional): Values of other symbols.
+            cache (:obj:`str`, optional): Directory of the cache of generated code, None to disable it.
+
+        Returns:
+            (:obj:`Problem`)
+        '''
+
+        if issubclass(cls, Fitting):
+            raise NameError('Fitting problems can not be built from symbolic expressions...')
+
+        compiler = fatDAE.base.class_symbolic.compiler(t, x, f, M, u, u_0, J, g, params, cache)
+
+        M, f, derivatives = compiler.problem()
+
+        if issubclass(cls, Control):
+
+            if J == None:
+                pass
+            else:
+                J = compiler.scalar('J')
+
+            if g == None:
+                pass
+            else:
+                g = compiler.scalar('g')
+
+            problem = cls(M, f, x_0, t_0, t_f, J, g, derivatives)
+
+        else:
+            problem = cls(M, f, x_0, t_0, t_f, derivatives, True)
+
+        problem.vectorized = True
+
+        problem.pattern_M = compiler.pattern('M')
+
+        problem.linear = compiler.linear
+
+        # Control values, shared with the compiled functions
+        problem.u = compiler.u
+
+        return problem
+
+    @classmethod
+    def from_affine(cls, M, A, b, theta, x_0, t_0, t_f):
+        ''' Instances a linear problem from an affine decomposition of its source
+
+        .. math::
+            \\begin{equation}
+                \\mathbf{f}(t, \\mathbf{x}) = A\\mathbf{x} + \\sum_{q=1}^{Q}\\theta_q(t)\\mathbf{b}_q
+            \\end{equation}
+
+        with constant :math:`M` and :math:`A`. The implicit solvers then build the stages from the
+        vectors :math:`\\mathbf{b}_q` and keep the factorizations of several step sizes, see
+        :meth:`fatDAE.class_solvers.DIRK.tstep_lin`.
+
+        Args:
+            M (:obj:`scipy.sparse.csc_matrix`): Matrix.
+            A (:obj:`scipy.sparse.csc_matrix`): Source derivative with respect to the state.
+            b (:obj:`numpy.ndarray`): Vectors :math:`\\mathbf{b}_q` by columns, or list of them.
+            theta (:obj:`function`): Function of time returning the :math:`Q` coefficients.
+            x_0 (:obj:`numpy.ndarray`)
+            t_0 (:obj:`int`)
+            t_f (:obj:`int`)
+
+        Returns:
+            (:obj:`Problem`): Without costs if a :class:`Control`, to be set afterwards.
+        '''
+
+        if issubclass(cls, Fitting):
+            raise NameError('Fitting problems can not be built from affine decompositions...')
+
+        if callable(M):
+            raise NameError('Linear problems require a constant matrix...')
+
+        if isinstance(b, list):
+            B = numpy.column_stack(b)
+        else:
+            B = b
+
+        def f(t, x):
+            return A.dot(x) + B.dot(theta(t))
+
+        def dfdx(t, x):
+            return A
+
+        # The flags are set afterwards, since the constructor of Control takes the costs in their place
+        problem = cls(M, f, x_0, t_0, t_f, derivatives={'dfdx': dfdx, 'pattern': scipy.sparse.csc_matrix(A != 0)})
+
+        problem.vectorized = False
+
+        problem.linear = True
+
+        problem.affine = {'A': A, 'b': B, 'theta': theta}
+
+        return problem
+
+    def detect_linear(self, n_probes=2, r_tol=1e-8, seed=0):
+        ''' Detects if the problem is linear, that is, with a constant matrix and
+
+        .. math::
+            \\begin{equation}
+                \\mathbf{f}(t, \\mathbf{x}) = A\\mathbf{x} + \\mathbf{b}(t)
+            \\end{equation}
+
+        The differences of the source along a random direction are compared at random times and states,
+        which are the same only if the jacobian is constant.
+
+        Args:
+            n_probes (:obj:`int`, optional): Number of random comparisons.
+            r_tol (:obj:`float`, optional): Relative tolerance of the comparisons.
+            seed (:obj:`int`, optional): Seed of the random times, states and direction, drawn from a local generator so the global one is not altered.
+
+        Returns:
+            (:obj:`bool`): True if linear, False otherwise.
+        '''
+
+        if callable(self.M):
+            return False
+
+        if self.vectorized:
+
+            def f(t, x):
+                return self.f(numpy.array([t]), x.reshape(-1, 1))[:, 0]
+
+        else:
+            f = self.f
+
+        scale = 1.0 + abs(self.x_0)
+
+        rng = numpy.random.RandomState(seed)
+
+        for k in range(n_probes):
+
+            t_1, t_2 = rng.uniform(self.t_0, self.t_f, 2)
+
+            x_1 = self.x_0 + scale * rng.uniform(-1.0, 1.0, self.dim)
+            x_2 = self.x_0 + scale * rng.uniform(-1.0, 1.0, self.dim)
+
+            y = scale * rng.uniform(-1.0, 1.0, self.dim)
+
+            d_1 = f(t_1, x_1 + y) - f(t_1, x_1)
+            d_2 = f(t_2, x_2 + y) - f(t_2, x_2)
+
+            # Also false for non finite values
+            if numpy.linalg.norm(d_1 - d_2, numpy.inf) <= r_tol * max(1.0, numpy.linalg.norm(d_1, numpy.inf)):
+                pass
+            else:
+                return False
+
+        return True
+
+    def detect_pattern(self, method='random', n_probes=2, n_times=3, seed=0):
+        ''' Detects the sparsity patterns of the source jacobian and of the matrix, unless already known.
+
+        If the source jacobian is given, its pattern is the one of its values at random states. The patterns are
+        the unions of those at the initial time and at :attr:`n_times` random times of the interval, so that
+        couplings vanishing at some times are kept. Both are stored in the problem, so they are detected only once, see
+        :func:`fatDAE.base.class_derivatives.detect_pattern`.
+
+        Args:
+            method (:obj:`str`, optional): 'random' or 'nan'.
+            n_probes (:obj:`int`, optional): Number of random points at each time.
+            n_times (:obj:`int`, optional): Number of random times, besides the initial one.
+            seed (:obj:`int`, optional): Seed of the random times and points.
+
+        Returns:
+            (:obj:`scipy.sparse.csc_matrix`): Sparsity pattern of the source jacobian.
+        '''
+
+        rng = numpy.random.RandomState(seed)
+
+        times = numpy.concatenate(([self.t_0], self.t_0 + (self.t_f - self.t_0) * rng.uniform(0.0, 1.0, n_times)))
+
+        if self.pattern is None:
+
+            pattern = scipy.sparse.csc_matrix((self.dim, self.dim), dtype=bool)
+
+            for k, t in enumerate(times):
+
+                if self.dfdx == None:
+
+                    if self.vectorized:
+
+                        def f(X, t=t):
+                            return self.f(numpy.full(X.shape[1], t), X)
+
+                    else:
+
+                        def f(x, t=t):
+                            return self.f(t, x)
+
+                    pattern = pattern + fatDAE.base.class_derivatives.detect_pattern(f, self.x_0, method, n_probes, vectorized=self.vectorized, seed=seed + k)
+
+                else:
+                    pattern = pattern + fatDAE.base.class_derivatives.matrix_pattern(self.dfdx, t, self.x_0, n_probes, seed=seed + k)
+
+            self.pattern = scipy.sparse.csc_matrix(pattern, dtype=bool)
+
+        if self.pattern_M is None:
+
+            pattern = scipy.sparse.csc_matrix((self.dim, self.dim), dtype=bool)
+
+            for k, t in enumerate(times):
+                pattern = pattern + fatDAE.base.class_derivatives.matrix_pattern(self.M, t, self.x_0, n_probes, seed=seed + k)
+
+            self.pattern_M = scipy.sparse.csc_matrix(pattern, dtype=bool)
+
+        return self.pattern
+
+    def solve(self, solver, state_machine=None, h=None, adp=False, adj=False, tlm=False, t_eval=None):
         ''' Solves with a given solver the problem.
 
         Args:
             solver (:obj:`class_solvers.Solver`): Solver instance.
+            h (:obj:`float`, optional): Step size, by default a thousandth of the interval, or estimated by the solver in adaptive mode, see :meth:`fatDAE.class_solvers.RK.hinit`.
             adp (:obj:`bool`):
             adj (:obj:`bool`):
+            t_eval (:obj:`numpy.ndarray`, optional): Times at which the state is stored, within the interval, instead of every step, see :meth:`fatDAE.class_solvers.RK.output_frw`.
         '''
 
-        if h == None:
+        if h == None and (adj or not adp):
             h = (self.t_f - self.t_0) / 1000.
 
+        if t_eval is None:
+            self.t_eval = None
+        else:
+
+            if adj or tlm:
+                raise NameError('Output times are not implemented for adjoint or tangent resolutions...')
+
+            self.t_eval = numpy.sort(numpy.array(t_eval, dtype=float).reshape(-1))
+
+            if self.t_eval.size > 0 and (self.t_eval[0] < self.t_0 or self.t_eval[-1] > self.t_f):
+                raise NameError('Output times must be within the interval...')
+
         if adj:
             return solver.solve_adj(self, state_machine, h, adp, tlm)
         else:
@@ -171,12 +476,12 @@ class Problem(object):
         self.t_list.append(t)
         self.x_list.append(x)
 
-        if delta_x == None:
+        if delta_x is None:
             pass
         else:
             self.delta_x_list.append(delta_x)
 
-        if delta_y == None:
+        if delta_y is None:
             pass
         else:
             self.delta_y_list.append(delta_y)
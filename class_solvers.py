@@ -7,17 +7,30 @@ import sys; sys.path.insert(0,'..'); from fatDAE.base.basic_import import *
 # User defined
 from fatDAE.base import class_solvers_nl
 from fatDAE.base import class_solvers_sp
+from fatDAE.base import class_stats
+from fatDAE.base import class_derivatives
+from fatDAE.base import class_jacobian
+from fatDAE.base import class_memo
+from fatDAE.base import class_progress
+from fatDAE.base import class_controllers
 
 import fatDAE.class_butcher
 import fatDAE.class_problem
 
-def build(butcher_json, embedded_1, embedded_2, a_tol=1e-8, r_tol=1e-3, s_fac=0.8, f_max=5.0, f_min=0.1, h_max=1.e+3, h_min=1.e-12):
+def build(butcher_json, embedded_1, embedded_2, a_tol=1e-8, r_tol=1e-3, s_fac=0.8, f_max=5.0, f_min=0.1, h_max=1.e+3, h_min=1.e-12, nlsolver='newton', precond=None, lsolver='auto', fd_method='forward', progress='silent', controller='elementary', band=None):
     '''Instances a solver from a Butcher table.
 
     Args:
         butcher_json (:obj:`dict`):
         embedded_1 (:obj:`bool`): True if the first method is going to be embedded, False otherwise.
         embedded_2 (:obj:`bool`): True if the second method is going to be embedded, False otherwise.
+        nlsolver (:obj:`str`, optional): Non-linear solver for implicit methods, 'newton', 'simplified' (Newton) or 'krylov' (Jacobian-free Newton-Krylov).
+        precond (:obj:`str`, optional): Preconditioner for Krylov solves, 'ilu', 'jacobi' or 'lu', see :data:`fatDAE.base.class_solvers_sp.preconds`.
+        lsolver (:obj:`str`, optional): Linear solver, 'auto' or a backend in :data:`fatDAE.base.class_solvers_sp.backends`.
+        fd_method (:obj:`str`, optional): Approximation of the jacobians not given by the problem, 'forward' or 'complex', see :data:`fatDAE.base.class_derivatives.jacobians`.
+        progress (:obj:`str`, optional): Observer of the progress, 'silent', 'print' or 'logging', see :data:`fatDAE.base.class_progress.observers`.
+        controller (:obj:`str`, optional): Step size controller, 'elementary', 'gustafsson', 'h211b' or 'pid', see :data:`fatDAE.base.class_controllers.controllers`.
+        band (:obj:`tuple`, optional): Hysteresis band of the step size factors which keep the step size, as (1.0, 1.2), None to disable it.
 
     Returns:
         solver (:obj:`Solver`):
@@ -30,6 +43,8 @@ def build(butcher_json, embedded_1, embedded_2, a_tol=1e-8, r_tol=1e-3, s_fac=0.
 
         solver = RW(advancing_table, estimator_table, a_tol, r_tol, s_fac, f_max, f_min, h_max, h_min)
 
+        solver.lusolver = class_solvers_sp.build(lsolver, precond)
+
     else:
 
         advancing_table = fatDAE.class_butcher.Butcher(butcher_json, embedded_1)
@@ -49,6 +64,39 @@ def build(butcher_json, embedded_1, embedded_2, a_tol=1e-8, r_tol=1e-3, s_fac=0.
                     else:
                         raise NameError('Unknown method or method not implemented yet...')
 
+        if nlsolver == 'newton':
+            solver.nlsolver = class_solvers_nl.solver_nt()
+        else:
+            if nlsolver == 'simplified':
+                solver.nlsolver = class_solvers_nl.solver_nt(simplified=True)
+            else:
+                if nlsolver == 'krylov':
+
+                    if precond == None:
+                        solver.nlsolver = class_solvers_nl.solver_kn()
+                    else:
+                        solver.nlsolver = class_solvers_nl.solver_kn(precond=class_solvers_sp.preconds[precond]())
+
+                else:
+                    raise NameError('Unknown non-linear solver...')
+
+        solver.nlsolver.solver = class_solvers_sp.build(lsolver, precond)
+
+    if fd_method in class_derivatives.jacobians:
+        solver.fd_method = fd_method
+    else:
+        raise NameError('Unknown approximation of the jacobian...')
+
+    if progress in class_progress.observers:
+        solver.progress = class_progress.observers[progress]()
+    else:
+        raise NameError('Unknown observer of the progress...')
+
+    if controller in class_controllers.controllers:
+        solver.controller = class_controllers.controllers[controller](band)
+    else:
+        raise NameError('Unknown step size controller...')
+
     return solver
 
 class Solver:
@@ -82,6 +130,22 @@ class RK(Solver):
         q (:obj:`int`): Minimum order of the methods.
         r (:obj:`int`): Maximum order of the methods.
         name (:obj:`str`): Name of the embedded Runge-Kutta method, including type and order of both methods.
+        n_dense (:obj:`int`): Dimension under which problems are solved in dense mode.
+        dense (:obj:`bool`): True if the actual problem is solved in dense mode, False otherwise.
+        pattern (:obj:`scipy.sparse.csc_matrix`): Sparsity pattern of the matrices :math:`M - h\\gamma J`, None in dense mode.
+        vectorized (:obj:`bool`): True if the problem evaluates blocks of times and states, see :class:`fatDAE.class_problem.Problem`.
+        linear (:obj:`bool`): True if the actual problem is linear, see :meth:`fatDAE.class_problem.Problem.detect_linear`.
+        affine (:obj:`dict`): Affine decomposition of the source of the actual problem, None if not given, see :meth:`fatDAE.class_problem.Problem.from_affine`.
+        h_ladder (:obj:`float`): Ratio of the geometric sequence to which the step sizes are rounded down in adaptive mode for affine problems, None to not round them.
+        n_levels (:obj:`int`): Number of step sizes whose factorizations are kept for affine problems.
+        fd_method (:obj:`str`): Approximation of the jacobian when the problem does not give it, 'forward' differences or 'complex' step, see :data:`fatDAE.base.class_derivatives.jacobians`.
+        stats (:obj:`fatDAE.base.class_stats.stats`): Statistics of the last resolution.
+        jac (:obj:`fatDAE.base.class_jacobian.manager`): Manager of the evaluations of the matrix and the jacobian, its criteria can be configured before solving.
+        f_memo (:obj:`fatDAE.base.class_memo.memo`): Memo of the evaluations of the source, shared by the stages and the derivatives by finite differences.
+        M_memo (:obj:`fatDAE.base.class_memo.memo`): Memo of the evaluations of the matrix, if not constant.
+        dxdt_memo (:obj:`fatDAE.base.class_memo.memo`): Memo of the derivatives of the state, see :meth:`dxdt`.
+        progress (:obj:`fatDAE.base.class_progress.observer`): Observer of the progress of the resolutions, silent by default.
+        controller (:obj:`fatDAE.base.class_controllers.elementary`): Step size controller in adaptive mode, elementary by default.
     '''
 
     def __init__(self, advancing_table, estimator_table, a_tol=1e-8, r_tol=1e-3, s_fac=0.8, f_max=5.0, f_min=0.1, h_max=1.e+3, h_min=1.e-12):
@@ -108,6 +172,29 @@ class RK(Solver):
         self.q = min(self.advancing_table.p, self.estimator_table.p)
         self.r = max(self.advancing_table.p, self.estimator_table.p)
 
+        # Dimension under which dense matrices are used
+        self.n_dense = 100
+
+        # Approximation of the jacobian when not given
+        self.fd_method = 'forward'
+
+        # Step sizes of affine problems, so that their factorizations are reused
+        self.h_ladder = 2.0 ** 0.25
+        self.n_levels = 8
+
+        self.stats = class_stats.stats()
+
+        self.jac = class_jacobian.manager()
+
+        self.f_memo = class_memo.memo('f')
+        self.M_memo = class_memo.memo('M')
+
+        self.dxdt_memo = class_memo.memo('dxdt', 2)
+
+        self.progress = class_progress.observer()
+
+        self.controller = class_controllers.elementary()
+
         # Name of the method
         self.name = self.__class__.__name__ + str(self.advancing_table.s) + '_' \
                                             + str(self.advancing_table.p) + '(' \
@@ -153,21 +240,27 @@ class RK(Solver):
 
         self.store_frw(problem)
 
-        print("Solving...")
+        self.progress.start(self)
 
-        start = time.time()
+        self.stats.tic('total')
 
         h0 = self.h
 
         while self.t < self.t_f:
 
-            print('Time ->', self.t)
+            self.progress.step(self)
 
             if self.t + self.h > self.t_f:
                 self.h = self.t_f - self.t
 
+            self.renew()
+
+            self.stats.tic('step')
+
             self.tstep_frw()
 
+            self.stats.toc('step'); self.stats.count('step')
+
             x_0 = self.x
             x_k = self.x
 
@@ -188,7 +281,9 @@ class RK(Solver):
 
                 if type(self.state_machine.actual_state) == type(fatDAE.class_machine.End()):
 
-                    print("Elapsed time: ", time.time() - start)
+                    self.progress.finish(self, 2)
+
+                    self.stats.toc('total')
 
                     return 2
 
@@ -206,13 +301,15 @@ class RK(Solver):
                     else:
                         self.store_frw(problem)
 
-                        self.tstep_tlm()
+                        self.stats.tic('tangent'); self.tstep_tlm(); self.stats.toc('tangent')
                         self.updat_tlm()
 
                     self.x = problem.solve_initial(self.x); self.h = h0
 
             else:
 
+                self.output_frw(problem)
+
                 if self.tlm == False:
 
                     self.updat_frw()
@@ -220,7 +317,7 @@ class RK(Solver):
 
                 else:
 
-                    self.tstep_tlm()
+                    self.stats.tic('tangent'); self.tstep_tlm(); self.stats.toc('tangent')
 
                     self.updat_frw()
                     self.updat_tlm()
@@ -231,7 +328,9 @@ class RK(Solver):
         else:
             self.cst = self.cst + self.J(self.t, self.x)
 
-        print("Elapsed time: ", time.time() - start)
+        self.progress.finish(self, 1)
+
+        self.stats.toc('total')
 
         return 1
 
@@ -240,7 +339,7 @@ class RK(Solver):
 
         Args:
             problem (:obj:`runge_kutta.class_problem.Control`)
-            h (:obj:`float`): Step size.
+            h (:obj:`float`): Initial step size, estimated by :meth:`hinit` if None.
             adj (:obj:`bool`): True if adjoint method will be used, False otherwise.
         '''
 
@@ -265,8 +364,12 @@ class RK(Solver):
         if self.adj == True:
             pass
         else:
+
             self.setup_frw(problem, h)
 
+            if h == None:
+                self.h = self.hinit()
+
         self.store_frw(problem)
 
         self.a_steps = 0
@@ -277,28 +380,36 @@ class RK(Solver):
         self.r_list = []
         self.d_list = []
 
-        print("Solving...")
+        self.progress.start(self)
 
-        start = time.time()
+        self.stats.tic('total')
 
         while self.t < self.t_f:
 
-            print('Time ->', self.t)
+            self.progress.step(self)
 
             if self.t + self.h > self.t_f:
                 self.h = self.t_f - self.t
 
             if self.h < self.h_min:
 
-                print ('Minimum stepsize reached...')
+                self.progress.finish(self, 0)
+
+                self.stats.toc('total')
 
                 return 0
 
             if self.h > self.h_max:
                 self.h = self.h_max
 
+            self.renew()
+
+            self.stats.tic('step')
+
             self.tstep_frw()
 
+            self.stats.toc('step'); self.stats.count('step')
+
             x_0 = self.x
             x_k = self.x
 
@@ -319,11 +430,9 @@ class RK(Solver):
 
                 if type(self.state_machine.actual_state) == type(fatDAE.class_machine.End()):
 
-                    print("Elapsed time: ", time.time() - start)
+                    self.progress.finish(self, 2)
 
-                    print('Accept. steps: ', self.a_steps)
-                    print('Reject. steps: ', self.r_steps)
-                    print('Diverg. steps: ', self.d_steps)
+                    self.stats.toc('total')
 
                     return 2
 
@@ -340,7 +449,7 @@ class RK(Solver):
                     self.write_frw(problem)
 
                     if self.tlm == True:
-                        self.tstep_tlm()
+                        self.stats.tic('tangent'); self.tstep_tlm(); self.stats.toc('tangent')
                         self.updat_tlm()
 
                     self.x = problem.solve_initial(self.x); self.h = 1.0
@@ -354,10 +463,12 @@ class RK(Solver):
 
                     if self.error_est < 1.0:
 
+                        self.output_frw(problem)
+
                         if self.tlm == False:
                             self.updat_frw()
                         else:
-                            self.tstep_tlm()
+                            self.stats.tic('tangent'); self.tstep_tlm(); self.stats.toc('tangent')
                             self.updat_frw()
                             self.updat_tlm()
 
@@ -385,7 +496,10 @@ class RK(Solver):
 
                 else:
 
-                    self.h = self.h / self.f_max
+                    if self.nlsolver.h_fac == None:
+                        self.h = self.h / self.f_max
+                    else:
+                        self.h = self.h * max(self.f_min, self.nlsolver.h_fac)
 
                     self.d_steps = self.d_steps + 1; self.d_list.append([self.t, self.h])
 
@@ -394,13 +508,9 @@ class RK(Solver):
         else:
             self.cst = self.cst + self.J(self.t, self.x)
 
-        print("Elapsed time: ", time.time() - start)
+        self.progress.finish(self, 1)
 
-        print('Accept. steps: ', self.a_steps)
-        print('Reject. steps: ', self.r_steps)
-        print('Diverg. steps: ', self.d_steps)
-
-        print('Maximum simulation time exceeded')
+        self.stats.toc('total')
 
         return 1
 
@@ -432,6 +542,10 @@ class RK(Solver):
     def setup_frw(self, problem, h=None):
         '''Configures the solver for one forward resolution.
 
+        Problems with dimension under :attr:`n_dense` are solved in dense mode, in which the matrix,
+        the jacobians and the tangent matrices are kept as :obj:`numpy.ndarray`, avoiding the overhead
+        of sparse matrices for small systems.
+
         Args:
             problem (:obj:`runge_kutta.class_problem.Problem`)
         '''
@@ -443,12 +557,53 @@ class RK(Solver):
         self.x = problem.x_0
         self.y = problem.x_0
 
-        self.delta_x = scipy.sparse.identity(self.x.size,format='csc')
-        self.delta_y = scipy.sparse.identity(self.x.size,format='csc')
+        self.dense = self.x.size < self.n_dense
+
+        self.stats = class_stats.stats(); self.attach(self.stats)
+
+        # Sparsity patterns, detected once per problem
+        if self.dense:
+            self.pattern = None
+        else:
+            problem.detect_pattern(); self.pattern = scipy.sparse.csc_matrix(problem.pattern + problem.pattern_M, dtype=bool)
+
+        if self.dense:
+            pattern = None
+        else:
+            pattern = problem.pattern
+
+        self.vectorized = getattr(problem, 'vectorized', False)
+
+        self.linear = getattr(problem, 'linear', False)
+        self.affine = getattr(problem, 'affine', None)
+
+        self.t_eval = getattr(problem, 't_eval', None)
+        self.i_eval = 0
+
+        if hasattr(self, 'nlsolver') and self.fd_method == 'forward':
+            self.fd_jac = class_derivatives.fd_jacobian(pattern, self.nlsolver.r_tol, self.vectorized)
+        else:
+            self.fd_jac = class_derivatives.jacobians[self.fd_method](pattern, vectorized=self.vectorized)
+
+        self.fd_sec = class_derivatives.fd_directional(pattern, vectorized=self.vectorized)
 
-        self.M = problem.M
+        if self.dense:
+            self.delta_x = numpy.identity(self.x.size)
+            self.delta_y = numpy.identity(self.x.size)
+        else:
+            self.delta_x = scipy.sparse.identity(self.x.size,format='csc')
+            self.delta_y = scipy.sparse.identity(self.x.size,format='csc')
+
+        self.M = self.densify(problem.M)
         self.f = problem.f
 
+        self.f_memo.reset(self.f)
+        self.M_memo.reset(self.M)
+
+        self.dxsolver = class_solvers_sp.solver_pj(); self.dxsolver.attach(self.stats)
+
+        self.dxdt_memo.reset(self.dxdt)
+
         self.K = numpy.zeros((self.advancing_table.s, self.x.size))
         self.L = numpy.zeros((self.advancing_table.s, self.x.size))
 
@@ -456,8 +611,12 @@ class RK(Solver):
         self.delta_L = []
 
         for i in range(self.advancing_table.s):
-            self.delta_K.append(scipy.sparse.csc_matrix((self.x.size, self.x.size)))
-            self.delta_L.append(scipy.sparse.csc_matrix((self.x.size, self.x.size)))
+            if self.dense:
+                self.delta_K.append(numpy.zeros((self.x.size, self.x.size)))
+                self.delta_L.append(numpy.zeros((self.x.size, self.x.size)))
+            else:
+                self.delta_K.append(scipy.sparse.csc_matrix((self.x.size, self.x.size)))
+                self.delta_L.append(scipy.sparse.csc_matrix((self.x.size, self.x.size)))
 
         if hasattr(problem, 'J'):
             self.J = problem.J
@@ -488,6 +647,8 @@ class RK(Solver):
         self.r_list = []
         self.d_list = []
 
+        self.controller.reset()
+
         self.t_list = []
         self.h_list = []
 
@@ -546,6 +707,17 @@ class RK(Solver):
 
         self.advancing_table.build_transposed()
 
+    def renew(self):
+        '''Marks the data depending on the step, as preconditioners, to be built again before one forward time step.
+        '''
+        pass
+
+    def attach(self, stats):
+        '''Records the statistics of the non-linear and linear solvers in a given instance.
+        '''
+
+        self.jac.attach(stats); self.f_memo.attach(stats); self.M_memo.attach(stats); self.dxdt_memo.attach(stats)
+
     def tstep_frw(self):
         '''Performs one forward time step.
         '''
@@ -645,6 +817,9 @@ class RK(Solver):
 
     def store_frw(self, problem):
         '''Store the state after one forward time step.
+
+        If output times are requested, see :meth:`fatDAE.class_problem.Problem.solve`, the state is only
+        stored at the initial time if requested, and the rest are stored by :meth:`output_frw`.
         '''
 
         if self.adj == True:
@@ -654,13 +829,43 @@ class RK(Solver):
             self.K_list.append(self.K)
             self.L_list.append(self.L)
 
+        if self.t_eval is None:
+            self.store_state(problem, self.t, self.x)
+        else:
+
+            if self.i_eval < self.t_eval.size and self.t_eval[self.i_eval] == self.t:
+                self.store_state(problem, self.t, self.x); self.i_eval = self.i_eval + 1
+
+    def output_frw(self, problem):
+        '''Store the states at the requested output times within the forward time step computed by :meth:`tstep_frw`, before :meth:`updat_frw`.
+
+        The states are evaluated by the continuous extension, see :meth:`interpolate`, so no step is
+        shortened to hit the output times. The output times skipped by the steps of a state machine
+        transition are not stored.
+        '''
+
+        if self.t_eval is None:
+            pass
+        else:
+
+            while self.i_eval < self.t_eval.size and self.t_eval[self.i_eval] <= self.t + self.h:
+
+                if self.t_eval[self.i_eval] > self.t:
+                    self.store_state(problem, self.t_eval[self.i_eval], self.interpolate(self.t_eval[self.i_eval]))
+
+                self.i_eval = self.i_eval + 1
+
+    def store_state(self, problem, t, x):
+        '''Store a given time and state in the problem.
+        '''
+
         if self.tlm == True:
-            problem.store(self.t, self.x, self.delta_x, problem.store_level)
+            problem.store(t, x, self.delta_x, problem.store_level)
         else:
             if self.state_machine == None:
-                problem.store(self.t, self.x, problem.store_level)
+                problem.store(t, x, problem.store_level)
             else:
-                problem.store(self.t, self.x, problem.store_level, self.state_machine.actual_state.name, self.state_machine.actual_state.params['number_states_count'])
+                problem.store(t, x, problem.store_level, self.state_machine.actual_state.name, self.state_machine.actual_state.params['number_states_count'])
 
     def write_frw(self, problem):
         '''Write the state
@@ -693,11 +898,181 @@ class RK(Solver):
 
         return t, x
 
+    def densify(self, A):
+        '''Converts a matrix, or a function returning a matrix, to dense form in dense mode.
+
+        Args:
+            A (:obj:`scipy.sparse.csc_matrix`): Matrix or function returning a matrix.
+
+        Returns:
+            (:obj:`numpy.ndarray`): Dense matrix or function returning a dense matrix, A itself if not in dense mode.
+        '''
+
+        if self.dense == False or A is None:
+            return A
+
+        if callable(A):
+
+            def B(*args):
+                return class_solvers_sp.to_dense(A(*args))
+
+            return B
+
+        else:
+            return class_solvers_sp.to_dense(A)
+
     def adapt(self):
-        '''Adjust the step size after one forward time step.
+        '''Adjust the step size after one forward time step, accepted or rejected, see :attr:`controller`.
+
+        For affine problems the step size is rounded down to a power of :attr:`h_ladder`, so that few
+        step sizes are used and their factorizations are reused. A step size already on the ladder, up to
+        rounding errors, is kept, and the rounded one is bounded by :attr:`h_min` and :attr:`h_max`.
         '''
 
-        self.h = self.h * min(self.f_max, max(self.f_min, self.s_fac * (1.0 / self.error_est) ** (1.0 / (self.q + 1))))
+        self.h = self.h * self.controller(self.error_est, self.h, self.q + 1, self.s_fac, self.f_min, self.f_max)
+
+        if self.affine is None or self.h_ladder == None:
+            pass
+        else:
+
+            # Below the minimum the resolution stops
+            if self.h < self.h_min:
+                pass
+            else:
+
+                h = self.h_ladder ** numpy.floor(numpy.log(self.h) / numpy.log(self.h_ladder) + 1e-10)
+
+                self.h = min(self.h_max, max(self.h_min, h))
+
+    def hinit(self):
+        '''Estimates the initial step size of an adaptive resolution [Hairer, Norsett and Wanner, II.4].
+
+        The derivatives of the state are computed from :math:`M\\dot{\\mathbf{x}} = \\mathbf{f}` at the
+        initial point and after an explicit Euler step of size
+
+        .. math::
+            \\begin{equation}
+                h_0 = 0.01\\frac{||\\mathbf{x}_0||}{||\\dot{\\mathbf{x}}_0||}
+            \\end{equation}
+
+        in the norm of :meth:`fatDAE.class_problem.Problem.error`, which estimates the second derivative
+        :math:`d_2`. The step size is the one giving an error of 0.01 with the minimum order :math:`q`
+
+        .. math::
+            \\begin{equation}
+                h = \\min\\left(100h_0, \\left(\\frac{0.01}{\\max(||\\dot{\\mathbf{x}}_0||, d_2)}\\right)^{1/(q+1)}\\right)
+            \\end{equation}
+
+        bounded by :attr:`h_max` and the length of the interval. If the matrix is singular, as for DAEs,
+        the derivatives of the algebraic variables are unknown and set to zero, see :meth:`dxdt`, so only
+        the differential variables are taken into account.
+
+        Returns:
+            (:obj:`float`): Initial step size.
+        '''
+
+        scale = self.a_tol + self.r_tol * numpy.linalg.norm(self.x, numpy.inf)
+
+        dxdt_0 = self.dxdt_memo(self.t, self.x)
+
+        d_0 = numpy.linalg.norm(self.x, numpy.inf) / scale
+        d_1 = numpy.linalg.norm(dxdt_0, numpy.inf) / scale
+
+        if d_0 < 1e-5 or d_1 < 1e-5:
+            h_0 = 1e-6
+        else:
+            h_0 = 0.01 * d_0 / d_1
+
+        h_0 = min(h_0, self.h_max, self.t_f - self.t)
+
+        dxdt_1 = self.dxdt_memo(self.t + h_0, self.x + h_0 * dxdt_0)
+
+        d_2 = numpy.linalg.norm(dxdt_1 - dxdt_0, numpy.inf) / scale / h_0
+
+        if max(d_1, d_2) <= 1e-15:
+            h_1 = max(1e-6, h_0 * 1e-3)
+        else:
+            h_1 = (0.01 / max(d_1, d_2)) ** (1.0 / (self.q + 1))
+
+        return min(100 * h_0, h_1, self.h_max, self.t_f - self.t)
+
+    def dxdt(self, t, x):
+        '''Computes the derivative of the state from :math:`M\\dot{\\mathbf{x}} = \\mathbf{f}`.
+
+        If the matrix is singular, as for DAEs, the least squares solution of minimum norm is returned,
+        in which the derivatives of the algebraic variables are zero, see :class:`fatDAE.base.class_solvers_sp.solver_pj`.
+        A constant matrix is only factorized once per resolution.
+
+        Args:
+            t (:obj:`float`): Time.
+            x (:obj:`numpy.ndarray`): State.
+
+        Returns:
+            (:obj:`numpy.ndarray`): Derivative of the state.
+        '''
+
+        if callable(self.M):
+            self.dxsolver.factorize(self.M_memo(t, x))
+        else:
+
+            if self.dxsolver.M is None:
+                self.dxsolver.factorize(self.M)
+
+        return self.dxsolver.solve(self.f_memo(t, x))
+
+    def interpolate(self, t):
+        '''Evaluates the continuous extension of the step computed by :meth:`tstep_frw`, before :meth:`updat_frw`.
+
+        With :math:`\\theta = (t - t_n)/h`, if the Butcher table gives the coefficients of a continuous
+        extension, see :class:`fatDAE.class_butcher.Butcher`, the state is
+
+        .. math::
+            \\begin{equation}
+                \\mathbf{x}(t) = \\mathbf{x}_n + \\sum_{i=1}^{s}b_i(\\theta)\\mathbf{k}_i
+            \\end{equation}
+
+        otherwise the cubic Hermite interpolant of the states and derivatives at both ends of the step
+        is used, see :meth:`dxdt`. The derivatives are memoized, so the one at the end of a step is reused
+        at the beginning of the next one. For the algebraic variables of DAEs, whose derivatives are
+        unknown, the Hermite interpolant reduces to the linear one.
+
+        Args:
+            t (:obj:`float`): Time, between :math:`t_n` and :math:`t_n + h`.
+
+        Returns:
+            (:obj:`numpy.ndarray`): State.
+        '''
+
+        theta = (t - self.t) / self.h
+
+        if self.advancing_table.B is None:
+
+            x_1 = self.x
+
+            for i in range(self.advancing_table.s):
+                x_1 = x_1 + self.advancing_table.b[i] * self.K[i, :]
+
+            d_0 = self.h * self.dxdt_memo(self.t, self.x)
+            d_1 = self.h * self.dxdt_memo(self.t + self.h, x_1)
+
+            if self.dxsolver.cols.size < self.x.size:
+
+                algebraic = numpy.setdiff1d(numpy.arange(self.x.size), self.dxsolver.cols)
+
+                d_0[algebraic] = x_1[algebraic] - self.x[algebraic]
+                d_1[algebraic] = x_1[algebraic] - self.x[algebraic]
+
+            return (2 * theta ** 3 - 3 * theta ** 2 + 1) * self.x + (theta ** 3 - 2 * theta ** 2 + theta) * d_0 \
+                 + (3 * theta ** 2 - 2 * theta ** 3) * x_1 + (theta ** 3 - theta ** 2) * d_1
+
+        else:
+
+            x = self.x
+
+            for i in range(self.advancing_table.s):
+                x = x + numpy.polyval(numpy.append(self.advancing_table.B[i, ::-1], 0.), theta) * self.K[i, :]
+
+            return x
 
     def check(self, problem):
         '''Check if the local error estimate is under the specified tolerance.
@@ -733,19 +1108,41 @@ class RK(Solver):
 
     def fd_dfdx(self, t, x):
         '''Computes source derivative with respect to the state by finite differences.
+
+        If the problem gives the sparsity pattern, the columns are grouped so that only one evaluation
+        of the source per group is required, see :class:`fatDAE.base.class_derivatives.fd_jacobian`.
         '''
 
-        A = numpy.zeros((len(x), len(x))); f = self.f(t, x)
+        if self.vectorized:
+            return self.fd_jac(self.source(t), x, self.dense)
+        else:
+            return self.fd_jac(self.source(t), x, self.dense, self.f_memo(t, x))
+
+    def source(self, t, y=None):
+        '''Returns the source as a function of the state only, accepting blocks of states if vectorized.
 
-        for i in range(len(x)):
+        Args:
+            t (:obj:`float`): Time.
+            y (:obj:`numpy.ndarray`, optional): Shift of the state.
+
+        Returns:
+            (:obj:`function`): Function of the state.
+        '''
 
-            y = x[i]
+        if y is None:
+            y = 0.
 
-            x[i] += self.nlsolver.r_tol * y
-            A[:, i] = (self.f(t, x) - f) / (self.nlsolver.r_tol * y)
-            x[i] -= self.nlsolver.r_tol * y
+        if self.vectorized:
 
-        return scipy.sparse.csc_matrix(A)
+            def f(Y):
+                return self.f(numpy.full(Y.shape[1], t), Y + numpy.reshape(y, (-1, 1)))
+
+        else:
+
+            def f(x):
+                return self.f(t, x + y)
+
+        return f
 
     def fd_dMdx(self, t, x, y):
         '''Computes matrix directional derivative with respect to the state by finite differences.
@@ -756,7 +1153,7 @@ class RK(Solver):
             \\end{equation}
         '''
 
-        return (self.M(t, x + self.nlsolver.r_tol * y) - self.M(t, x)) / self.nlsolver.r_tol
+        return (self.M(t, x + self.nlsolver.r_tol * y) - self.M_memo(t, x)) / self.nlsolver.r_tol
 
 class ERK(RK):
     ''' Explicit Runge-Kutta solver.
@@ -825,12 +1222,31 @@ class IRK(RK):
         if problem.dMdx == None:
             self.dMdx = self.fd_dMdx
         else:
-            self.dMdx = problem.dMdx
+            self.dMdx = self.densify(problem.dMdx)
 
         if problem.dfdx == None:
             self.dfdx = self.fd_dfdx
         else:
-            self.dfdx = problem.dfdx
+            self.dfdx = self.densify(problem.dfdx)
+
+        if callable(self.M):
+            self.jac.reset(self.M_memo, self.dfdx)
+        else:
+            self.jac.reset(self.M, self.dfdx)
+
+        self.nlsolver.refresh = True
+
+        self.nlsolver.reset(self.pattern)
+
+        # One factorization per diagonal coefficient for the whole integration if linear
+        if self.linear:
+
+            size = numpy.unique(numpy.diag(self.advancing_table.A)).size
+
+            if self.affine is None:
+                self.nlsolver.solver.size = max(self.nlsolver.solver.size, size)
+            else:
+                self.nlsolver.solver.size = max(self.nlsolver.solver.size, size * self.n_levels)
 
     def setup_adj(self, problem, h=None):
         '''Configures the solver for one adjoint resolution.
@@ -838,6 +1254,44 @@ class IRK(RK):
 
         RK.setup_adj(self, problem, h)
 
+    def renew(self):
+        '''Marks the data depending on the step, as preconditioners, to be built again before one forward time step.
+        '''
+
+        self.nlsolver.renew()
+
+    def attach(self, stats):
+        '''Records the statistics of the non-linear and linear solvers in a given instance.
+        '''
+
+        RK.attach(self, stats); self.nlsolver.attach(stats)
+
+    def newton_matrix(self, a):
+        '''Build the matrix used by simplified Newton iterations.
+
+        .. math::
+            \\begin{equation}
+                J = M(t_J, \\mathbf{x}_J) - h_Ja\\frac{\\partial \\mathbf{f}}{\\partial\\mathbf{x} }(t_J,\\mathbf{x}_J)
+            \\end{equation}
+
+        The jacobian is kept across stages and steps by :attr:`jac`, and only evaluated again at the
+        beginning of the actual step when :attr:`nlsolver.refresh` = True or when it is stale, see
+        :class:`fatDAE.base.class_jacobian.manager`.
+
+        Args:
+            a (:obj:`float`): Diagonal coefficient of the stage.
+
+        Returns:
+            (tuple): Tuple containing:
+
+            - **J** (:obj:`scipy.sparse.csc_matrix`): Iteration matrix.
+            - **key** (:obj:`tuple`): Key identifying the iteration matrix.
+        '''
+
+        self.jac.request(self.t, self.x, self.nlsolver.refresh); self.nlsolver.refresh = False
+
+        return self.jac.matrix(a, self.h)
+
 class FIRK(IRK):
     ''' Full implicit Runge-Kutta solver.
 
@@ -989,11 +1443,11 @@ class DIRK(IRK):
         def F(x):
 
             if callable(self.M):
-                M = self.M(ti, xi + self.advancing_table.A[i, i] * x)
+                M = self.M_memo(ti, xi + self.advancing_table.A[i, i] * x)
             else:
                 M = self.M
 
-            return M.dot(x) - self.h * self.f(ti, xi + self.advancing_table.A[i, i] * x)
+            return M.dot(x) - self.h * self.f_memo(ti, xi + self.advancing_table.A[i, i] * x)
 
         if self.nlsolver.simplified:
 
@@ -1003,15 +1457,13 @@ class DIRK(IRK):
 
             def J(x):
 
-                if callable(self.M):
-                    A = self.advancing_table.A[i, i] * self.dMdx(ti, xi + self.advancing_table.A[i, i] * x, x) + self.M(ti, xi + self.advancing_table.A[i, i] * x)
-                else:
-                    A = self.M
+                # Evaluated at every iterate unless a state change criterion is set
+                M, dfdx = self.jac.request(ti, xi + self.advancing_table.A[i, i] * x, self.jac.x_ratio == None)
 
-                if callable(self.dfdx):
-                    dfdx = self.dfdx(ti, xi + self.advancing_table.A[i, i] * x)
+                if callable(self.M):
+                    A = self.advancing_table.A[i, i] * self.dMdx(ti, xi + self.advancing_table.A[i, i] * x, x) + M
                 else:
-                    dfdx = self.dfdx
+                    A = M
 
                 return A - self.h * self.advancing_table.A[i, i] * dfdx
 
@@ -1071,6 +1523,94 @@ class DIRK(IRK):
                 self.dgdx_step.append(self.dgdx(t, x + self.advancing_table.A[i, i] * self.K[i, :]))
                 self.dgdu_step.append(self.dgdu(t, x + self.advancing_table.A[i, i] * self.K[i, :]))
 
+    def tstep_lin(self, first=0):
+        '''Performs one forward time step of a linear problem.
+
+        As the source is affine in the state, with constant jacobian :math:`A`, each stage is the solution
+        of one linear system
+
+        .. math::
+            \\begin{equation}
+                (M - ha_{ii}A)\\mathbf{k}_i = h\\mathbf{f}(t_n+c_ih,\\mathbf{x}_n+\\sum_{j=1}^{i-1}a_{ij}\\mathbf{k}_j),\\quad i=1,\\dots, s
+            \\end{equation}
+
+        and the factorizations are kept while the step size does not change, see
+        :class:`fatDAE.base.class_solvers_sp.solver_lu`.
+
+        If the affine decomposition of the source is given, the time dependent terms of all the stages
+        are built at once from its vectors, and the source is not evaluated.
+
+        As an inaccurate jacobian, or a problem wrongly detected as linear, would give wrong stages
+        silently, the residual of the last stage
+
+        .. math::
+            \\begin{equation}
+                \\mathbf{F}_s(\\mathbf{k}_s) = M\\mathbf{k}_s - h\\mathbf{f}(t_n+c_sh,\\mathbf{x}_n+\\sum_{j=1}^{s}a_{sj}\\mathbf{k}_j)
+            \\end{equation}
+
+        is checked. The Newton correction it gives, one more substitution with the kept factorization,
+        must be a small fraction of the tolerance of the step, as in the stopping criterion of Hairer and Wanner
+
+        .. math::
+            \\begin{equation}
+                ||\\Delta|| \\leq \\kappa(a_{tol} + r_{tol}||\\mathbf{x}_n||), \\quad \\kappa = 10^{-2}
+            \\end{equation}
+
+        If it fails, the problem is solved by Newton iterations for the rest of the resolution, starting
+        with this step, and the failure is counted as 'linear failure'.
+
+        Args:
+            first (:obj:`int`, optional): First implicit stage.
+        '''
+
+        M, A = self.jac.request(self.t, self.x)
+
+        if self.affine is None:
+            pass
+        else:
+
+            theta = numpy.column_stack([self.affine['theta'](self.t + self.advancing_table.c[i] * self.h) for i in range(self.advancing_table.s)])
+
+            b = self.affine['b'].dot(theta)
+
+        for i in range(first, self.advancing_table.s):
+
+            ti, xi = self.state_frw(i)
+
+            key = (self.h, self.advancing_table.A[i, i], self.jac.version)
+
+            if self.nlsolver.solver.cached(key):
+                self.nlsolver.solver.factorize(None, key)
+            else:
+                self.nlsolver.solver.factorize(M - self.h * self.advancing_table.A[i, i] * A, key)
+
+            if self.affine is None:
+                self.K[i, :] = self.nlsolver.solver.solve(self.h * self.f_memo(ti, xi))
+            else:
+                self.K[i, :] = self.nlsolver.solver.solve(self.h * (self.affine['A'].dot(xi) + b[:, i]))
+
+        # Residual of the last stage, whose factorization is the stored one
+        xi = xi + self.advancing_table.A[i, i] * self.K[i, :]
+
+        if self.affine is None:
+            F = M.dot(self.K[i, :]) - self.h * self.f_memo(ti, xi)
+        else:
+            F = M.dot(self.K[i, :]) - self.h * (self.affine['A'].dot(xi) + b[:, i])
+
+        Delta = self.nlsolver.solver.solve(- F)
+
+        error = numpy.linalg.norm(Delta, numpy.inf) / (self.a_tol + self.r_tol * numpy.linalg.norm(self.x, numpy.inf))
+
+        if numpy.isfinite(error) and error <= 1e-2 and not self.nlsolver.solver.failed:
+            self.nlsolver.converged = True
+        else:
+
+            self.stats.count('linear failure')
+
+            self.linear = False; self.nlsolver.refresh = True
+
+            self.tstep_frw()
+
     def tstep_frw(self):
         '''Performs one forward time step.
 
@@ -1095,42 +1635,38 @@ class DIRK(IRK):
 
             .. math::
                 \\begin{equation}
-                    J_i = M - ha_{ii}\\frac{\\partial \\mathbf{f}}{\\partial\\mathbf{x} }(t_n,\\mathbf{x}_n),\\quad i=1,\\dots, s
+                    J_i = M - h_Ja_{ii}\\frac{\\partial \\mathbf{f}}{\\partial\\mathbf{x} }(t_J,\\mathbf{x}_J),\\quad i=1,\\dots, s
                 \\end{equation}
 
-            are used to perform simplified Newton iterations.
+            built by :meth:`newton_matrix` are used to perform simplified Newton iterations.
         '''
 
-        if self.nlsolver.simplified:
-
-            if callable(self.M):
-                M = self.M(self.t, self.x)
-            else:
-                M = self.M
-
-            if callable(self.dfdx):
-                dfdx = self.dfdx(self.t, self.x)
-            else:
-                dfdx = self.dfdx
+        if self.linear:
+            return self.tstep_lin()
 
         for i in range(self.advancing_table.s):
 
             if self.nlsolver.simplified:
 
-                F, _ = self.stage_frw(i); J = M - self.h * self.advancing_table.A[i, i] * dfdx
+                F, _ = self.stage_frw(i); J, key = self.newton_matrix(self.advancing_table.A[i, i])
 
             else:
 
-                F, J = self.stage_frw(i)
+                F, J = self.stage_frw(i); key = None
 
             if i == 0:
-                self.K[i, :], ite = self.nlsolver.solve(F, J, self.h * self.f(self.t, self.x))
+                self.K[i, :], ite = self.nlsolver.solve(F, J, self.h * self.f_memo(self.t, self.x), key)
             else:
-                self.K[i, :], ite = self.nlsolver.solve(F, J, self.K[i - 1, :])
+                self.K[i, :], ite = self.nlsolver.solve(F, J, self.K[i - 1, :], key)
 
             if self.nlsolver.converged:
                 pass
             else:
+
+                # Retry once with a jacobian evaluated at the actual step
+                if self.nlsolver.simplified and self.jac.t != self.t:
+                    self.tstep_frw()
+
                 return
 
     def tstep_tlm(self):
@@ -1140,23 +1676,17 @@ class DIRK(IRK):
 
             ti, xi = self.state_frw(i)
 
-            if callable(self.M):
-                M = self.M(ti, xi + self.advancing_table.A[i, i] * self.K[i, :])
-            else:
-                M = self.M
-
-            if callable(self.dfdx):
-                dfdx = self.dfdx(ti, xi + self.advancing_table.A[i, i] * self.K[i, :])
-            else:
-                dfdx = self.dfdx
+            M, dfdx = self.jac.evaluate(ti, xi + self.advancing_table.A[i, i] * self.K[i, :])
 
             b_x = self.delta_x
 
             for j in range(i):
                 b_x = b_x + self.advancing_table.A[i, j] * self.delta_K[j]
 
-            self.delta_K[i] = self.nlsolver.solver.solve(M - self.h * self.advancing_table.A[i,i] * dfdx, \
-                                                         self.h * dfdx * b_x)
+            self.nlsolver.solver.factorize(M - self.h * self.advancing_table.A[i,i] * dfdx, \
+                                           (self.h, self.advancing_table.A[i, i], self.jac.version))
+
+            self.delta_K[i] = self.nlsolver.solver.solve(self.h * dfdx.dot(b_x)); self.nlsolver.solver.check()
 
     def tstep_adj(self):
         '''Performs one adjoint time step.
@@ -1199,7 +1729,9 @@ class DIRK(IRK):
                     b = b + self.h * self.advancing_table.A_T[i, j] * self.dfdx_step[j].transpose().dot(self.X[j, :]) \
                           + self.h * self.advancing_table.A_T[i, j] * self.dgdx_step[j]
 
-            self.X[i, :] = self.nlsolver.solver.solve(A.transpose(), b)
+            self.nlsolver.solver.factorize(A)
+
+            self.X[i, :] = self.nlsolver.solver.solve(b, trans='T'); self.nlsolver.solver.check()
 
 class SDIRK(DIRK):
     ''' Singly diagonally implicit Runge-Kutta solver.
@@ -1247,25 +1779,17 @@ class SDIRK(DIRK):
 
             .. math::
                 \\begin{equation}
-                    J = M - h\\gamma\\frac{\\partial \\mathbf{f}}{\\partial\\mathbf{x} }(t_n,\\mathbf{y}_n)
+                    J = M - h_J\\gamma\\frac{\\partial \\mathbf{f}}{\\partial\\mathbf{x} }(t_J,\\mathbf{x}_J)
                 \\end{equation}
 
-            is used to perform simplified Newton iterations.
+            built by :meth:`newton_matrix` is used to perform simplified Newton iterations.
         '''
 
-        if self.nlsolver.simplified:
+        if self.linear:
+            return self.tstep_lin()
 
-            if callable(self.M):
-                M = self.M(self.t, self.x)
-            else:
-                M = self.M
-
-            if callable(self.dfdx):
-                dfdx = self.dfdx(self.t, self.x)
-            else:
-                dfdx = self.dfdx
-
-            J = M - self.h * self.advancing_table.A[-1, -1] * dfdx
+        if self.nlsolver.simplified:
+            J, key = self.newton_matrix(self.advancing_table.A[-1, -1])
 
         for i in range(self.advancing_table.s):
 
@@ -1275,16 +1799,21 @@ class SDIRK(DIRK):
 
             else:
 
-                F, J = self.stage_frw(i)
+                F, J = self.stage_frw(i); key = None
 
             if i == 0:
-                self.K[i, :], ite = self.nlsolver.solve(F, J, self.h * self.f(self.t, self.x))
+                self.K[i, :], ite = self.nlsolver.solve(F, J, self.h * self.f_memo(self.t, self.x), key)
             else:
-                self.K[i, :], ite = self.nlsolver.solve(F, J, self.K[i - 1, :])
+                self.K[i, :], ite = self.nlsolver.solve(F, J, self.K[i - 1, :], key)
 
             if self.nlsolver.converged:
                 pass
             else:
+
+                # Retry once with a jacobian evaluated at the actual step
+                if self.nlsolver.simplified and self.jac.t != self.t:
+                    self.tstep_frw()
+
                 return
 
 class EDIRK(DIRK):
@@ -1305,53 +1834,79 @@ class EDIRK(DIRK):
         \\end{equation}
     '''
 
-    def __init__(self, advancing_table, estimator_table):
+    def __init__(self, advancing_table, estimator_table, a_tol=1e-8, r_tol=1e-3, s_fac=0.8, f_max=5.0, f_min=0.1, h_max=1.e+3, h_min=1.e-12):
 
-        DIRK.__init__(self, advancing_table, estimator_table)
+        DIRK.__init__(self, advancing_table, estimator_table, a_tol, r_tol, s_fac, f_max, f_min, h_max, h_min)
 
         self.lqsolver = class_solvers_sp.solver_lq()
+        self.pjsolver = class_solvers_sp.solver_pj()
 
-    def tstep_frw(self):
-        '''Performs one forward time step.
+    def setup_frw(self, problem, h=None):
+        '''Configures the solver for one forward resolution.
+
+        If the matrix is constant its structure is analyzed once, see :class:`fatDAE.base.class_solvers_sp.solver_pj`.
+        '''
 
-        The first stage is computed explicitly as
+        DIRK.setup_frw(self, problem, h)
+
+        if callable(self.M):
+            self.pjsolver.invalidate()
+        else:
+            self.pjsolver.factorize(self.M)
+
+    def attach(self, stats):
+        '''Records the statistics of the non-linear and linear solvers in a given instance.
+        '''
+
+        DIRK.attach(self, stats); self.pjsolver.attach(stats)
+
+    def stage_exp(self):
+        '''Computes the explicit first stage
 
         .. math::
             \\begin{equation}
                 M\\mathbf{k}_1 = h\\mathbf{f}(t_n,\\mathbf{y}_n)
             \\end{equation}
 
-        in contrast with :meth:`SDIRK.tstep_frw`.
+        in the least squares sense if :math:`M` is singular.
         '''
 
         if callable(self.M):
-            M = self.M(self.t, self.x)
+            self.K[0, :] = self.lqsolver.solve(self.M_memo(self.t, self.x), self.h * self.f_memo(self.t, self.x))
         else:
-            M = self.M
+            self.K[0, :] = self.pjsolver.solve(self.h * self.f_memo(self.t, self.x))
+
+    def tstep_frw(self):
+        '''Performs one forward time step.
 
-        self.K[0, :] = self.lqsolver.solve(M, self.h * self.f(self.t, self.x))
+        The first stage is computed explicitly by :meth:`stage_exp`, in contrast with :meth:`SDIRK.tstep_frw`.
+        '''
 
-        if self.nlsolver.simplified:
+        self.stage_exp()
 
-            if callable(self.dfdx):
-                dfdx = self.dfdx(self.t, self.x)
-            else:
-                dfdx = self.dfdx
+        if self.linear:
+            return self.tstep_lin(1)
 
         for i in range(1, self.advancing_table.s):
 
             if self.nlsolver.simplified:
 
-                F, _ = self.stage_frw(i); J = M - self.h * self.advancing_table.A[i, i] * dfdx
+                F, _ = self.stage_frw(i); J, key = self.newton_matrix(self.advancing_table.A[i, i])
 
             else:
-                F, J = self.stage_frw(i)
 
-            self.K[i, :], ite = self.nlsolver.solve(F, dFdx, self.K[i - 1, :])
+                F, J = self.stage_frw(i); key = None
+
+            self.K[i, :], ite = self.nlsolver.solve(F, J, self.K[i - 1, :], key)
 
             if self.nlsolver.converged:
                 pass
             else:
+
+                # Retry once with a jacobian evaluated at the actual step
+                if self.nlsolver.simplified and self.jac.t != self.t:
+                    self.tstep_frw()
+
                 return
 
 class ESDIRK(DIRK):
@@ -1372,40 +1927,61 @@ class ESDIRK(DIRK):
         \\end{equation}
     '''
 
-    def __init__(self, advancing_table, estimator_table):
+    def __init__(self, advancing_table, estimator_table, a_tol=1e-8, r_tol=1e-3, s_fac=0.8, f_max=5.0, f_min=0.1, h_max=1.e+3, h_min=1.e-12):
 
-        DIRK.__init__(self, advancing_table, estimator_table)
+        DIRK.__init__(self, advancing_table, estimator_table, a_tol, r_tol, s_fac, f_max, f_min, h_max, h_min)
 
         self.lqsolver = class_solvers_sp.solver_lq()
+        self.pjsolver = class_solvers_sp.solver_pj()
 
-    def tstep_frw(self):
-        '''Performs one forward time step.
+    def setup_frw(self, problem, h=None):
+        '''Configures the solver for one forward resolution.
+
+        If the matrix is constant its structure is analyzed once, see :class:`fatDAE.base.class_solvers_sp.solver_pj`.
+        '''
+
+        DIRK.setup_frw(self, problem, h)
+
+        if callable(self.M):
+            self.pjsolver.invalidate()
+        else:
+            self.pjsolver.factorize(self.M)
+
+    def attach(self, stats):
+        '''Records the statistics of the non-linear and linear solvers in a given instance.
+        '''
+
+        DIRK.attach(self, stats); self.pjsolver.attach(stats)
 
-        The first stage is computed explicitly as
+    def stage_exp(self):
+        '''Computes the explicit first stage
 
         .. math::
             \\begin{equation}
                 M\\mathbf{k}_1 = h\\mathbf{f}(t_n,\\mathbf{y}_n)
             \\end{equation}
 
-        in contrast with :meth:`SDIRK.tstep_frw`.
+        in the least squares sense if :math:`M` is singular.
         '''
 
         if callable(self.M):
-            M = self.M(self.t, self.x)
+            self.K[0, :] = self.lqsolver.solve(self.M_memo(self.t, self.x), self.h * self.f_memo(self.t, self.x))
         else:
-            M = self.M
+            self.K[0, :] = self.pjsolver.solve(self.h * self.f_memo(self.t, self.x))
 
-        self.K[0, :] = self.lqsolver.solve(M, self.h * self.f(self.t, self.x))
+    def tstep_frw(self):
+        '''Performs one forward time step.
 
-        if self.nlsolver.simplified:
+        The first stage is computed explicitly by :meth:`stage_exp`, in contrast with :meth:`SDIRK.tstep_frw`.
+        '''
 
-            if callable(self.dfdx):
-                dfdx = self.dfdx(self.t, self.x)
-            else:
-                dfdx = self.dfdx
+        self.stage_exp()
+
+        if self.linear:
+            return self.tstep_lin(1)
 
-            J = M - self.h * self.advancing_table.A[-1, -1] * dfdx
+        if self.nlsolver.simplified:
+            J, key = self.newton_matrix(self.advancing_table.A[-1, -1])
 
         for i in range(1, self.advancing_table.s):
 
@@ -1414,13 +1990,19 @@ class ESDIRK(DIRK):
                 F, _ = self.stage_frw(i)
 
             else:
-                F, J = self.stage_frw(i)
 
-            self.K[i, :], ite = self.nlsolver.solve(F, dFdx, self.K[i - 1, :])
+                F, J = self.stage_frw(i); key = None
+
+            self.K[i, :], ite = self.nlsolver.solve(F, J, self.K[i - 1, :], key)
 
             if self.nlsolver.converged:
                 pass
             else:
+
+                # Retry once with a jacobian evaluated at the actual step
+                if self.nlsolver.simplified and self.jac.t != self.t:
+                    self.tstep_frw()
+
                 return
 
 class RW(RK):
@@ -1445,7 +2027,7 @@ class RW(RK):
 
         RK.__init__(self, advancing_table, estimator_table, a_tol, r_tol, s_fac, f_max, f_min, h_max, h_min)
 
-        self.spsolver = class_solvers_sp.solver_sp()
+        self.lusolver = class_solvers_sp.solver_lu()
         self.lqsolver = class_solvers_sp.solver_lq()
 
     def setup_frw(self, problem, h=None):
@@ -1454,15 +2036,22 @@ class RW(RK):
 
         RK.setup_frw(self, problem, h)
 
+        self.lusolver.reset(self.pattern)
+
         if problem.dMdx == None:
             self.dMdx = self.fd_dMdx
         else:
-            self.dMdx = problem.dMdx
+            self.dMdx = self.densify(problem.dMdx)
 
         if problem.dfdx == None:
             self.dfdx = self.fd_dfdx
         else:
-            self.dfdx = problem.dfdx
+            self.dfdx = self.densify(problem.dfdx)
+
+        if callable(self.M):
+            self.jac.reset(self.M_memo, self.dfdx)
+        else:
+            self.jac.reset(self.M, self.dfdx)
 
         if problem.dfdt == None:
             self.dfdt = self.fd_dfdt
@@ -1495,6 +2084,18 @@ class RW(RK):
         else:
             self.d2fdtdu = problem.d2fdtdu
 
+    def renew(self):
+        '''Marks the data depending on the step, as preconditioners, to be built again before one forward time step.
+        '''
+
+        self.lusolver.renew()
+
+    def attach(self, stats):
+        '''Records the statistics of the linear solvers in a given instance.
+        '''
+
+        RK.attach(self, stats); self.lusolver.attach(stats); self.lqsolver.attach(stats)
+
     def updat_lmb(self):
         '''Update the adjoint state after one adjoint time step.
         '''
@@ -1593,19 +2194,19 @@ class RW(RK):
                                           + & h^2d_i\\frac{\\partial \\mathbf{f}}{\\partial t}(t_n, \\mathbf{x}_n),\\quad i=1,\\dots, s
                 \\end{split}
             \\end{equation}
-        '''
 
-        if callable(self.dfdx):
-            dfdx = self.dfdx(self.t, self.x)
-        else:
-            dfdx = self.dfdx
+        The order conditions assume the exact jacobian :math:`J`, so it is only reused on the retries
+        of rejected steps, unless a state change criterion is set in :attr:`jac`, turning the method
+        into a W-method of possibly lower order.
+        '''
 
         if callable(self.M):
             raise NameError('Feature not implemented yet...')
         else:
-            M = self.M
+            M, dfdx = self.jac.request(self.t, self.x, self.jac.x_ratio == None and self.jac.t != self.t)
 
-        A = M - self.h * self.advancing_table.G[0, 0] * dfdx
+        self.lusolver.factorize(M - self.h * self.advancing_table.G[0, 0] * dfdx, \
+                                (self.h, self.advancing_table.G[0, 0], self.jac.version))
 
         if callable(self.dfdt):
             dfdt = self.dfdt(self.t, self.x)
@@ -1623,7 +2224,7 @@ class RW(RK):
 
                 xi = xi + self.advancing_table.A[i, j] * self.K[j, :]; sum_x = sum_x + self.advancing_table.G[i, j] * self.K[j, :]
 
-            self.K[i, :] = self.spsolver.solve(A, self.h * self.f(ti, xi) + self.h * dfdx.dot(sum_x) + self.h ** 2 * self.advancing_table.d[i] * dfdt)
+            self.K[i, :] = self.lusolver.solve(self.h * self.f_memo(ti, xi) + self.h * dfdx.dot(sum_x) + self.h ** 2 * self.advancing_table.d[i] * dfdt); self.lusolver.check()
 
     def tsetp_tlm(self):
         #TODO
@@ -1639,6 +2240,8 @@ class RW(RK):
         else:
             A = self.M - self.h * self.advancing_table.G[0, 0] * self.dfdx_step[0]
 
+        self.lusolver.factorize(A)
+
         # Loop in stages
         for i in range(self.advancing_table.s - 1, - 1, - 1):
 
@@ -1656,7 +2259,7 @@ class RW(RK):
                     b = b + self.h * B_ij.transpose().dot(self.X[j, :]) + self.h * self.advancing_table.A_T[i, j] * self.dgdx_step[j]
 
             # Solve linear system
-            self.X[i, :] = self.spsolver.solve(A.transpose(), b)
+            self.X[i, :] = self.lusolver.solve(b, trans='T'); self.lusolver.check()
 
     def fd_dfdt(self, t, x):
         '''Computes source derivative with respect to time by finite differences.
@@ -1674,27 +2277,69 @@ class RW(RK):
             dfdt (:obj:`numpy.ndarray`): Source derivatives with respect to time.
         '''
 
+        if self.vectorized:
+            return self.fd_time(self.f, t, x)
+
         if self.r < 3:
             # First order
-            dfdt = (self.f(t + self.h, x) - self.f(t, x)) / self.h
+            dfdt = (self.f(t + self.h, x) - self.f_memo(t, x)) / self.h
 
         elif self.r < 4:
            # Second order
-           dfdt = (4.0 * self.f(t + self.h, x) - self.f(t + 2.0 * self.h, x) - 3.0 * self.f(t, x)) / (2.0 * self.h)
+           dfdt = (4.0 * self.f(t + self.h, x) - self.f(t + 2.0 * self.h, x) - 3.0 * self.f_memo(t, x)) / (2.0 * self.h)
 
         elif self.r < 6:
            # Fourth order
            dfdt = (48.0 * self.f(t + self.h, x) - 36.0 * self.f(t + 2.0 * self.h, x) \
-                                                + 16.0 * self.f(t + 3.0 * self.h, x) - 3.0 * self.f(t + 4.0 * self.h, x) - 25.0 * self.f(t, x)) / (12.0 * self.h)
+                                                + 16.0 * self.f(t + 3.0 * self.h, x) - 3.0 * self.f(t + 4.0 * self.h, x) - 25.0 * self.f_memo(t, x)) / (12.0 * self.h)
 
         else:
 
             print("Possible order reduction, using fourth order finite differences on time...")
             dfdt = (48.0 * self.f(t + self.h, x) - 36.0 * self.f(t + 2.0 * self.h, x) \
-                                                 + 16.0 * self.f(t + 3.0 * self.h, x) - 3.0 * self.f(t + 4.0 * self.h, x) - 25.0 * self.f(t, x)) / (12.0 * self.h)
+                                                 + 16.0 * self.f(t + 3.0 * self.h, x) - 3.0 * self.f(t + 4.0 * self.h, x) - 25.0 * self.f_memo(t, x)) / (12.0 * self.h)
 
         return dfdt
 
+    def fd_time(self, g, t, x):
+        '''Computes the derivative with respect to time of a vectorized function by finite differences.
+
+        The same formulas as :meth:`fd_dfdt` are used, but all the times are evaluated in one call.
+
+        Args:
+            g (:obj:`function`): Vectorized function, the source or the matrix.
+            t (:obj:`float`): Time.
+            x (:obj:`numpy.ndarray`): State.
+
+        Returns:
+            (:obj:`numpy.ndarray`): Derivative with respect to time.
+        '''
+
+        if self.r < 3:
+            # First order
+            c = numpy.array([- 1.0, 1.0]) / self.h
+
+        elif self.r < 4:
+            # Second order
+            c = numpy.array([- 3.0, 4.0, - 1.0]) / (2.0 * self.h)
+
+        else:
+
+            if self.r < 6:
+                pass
+            else:
+                print("Possible order reduction, using fourth order finite differences on time...")
+
+            # Fourth order
+            c = numpy.array([- 25.0, 48.0, - 36.0, 16.0, - 3.0]) / (12.0 * self.h)
+
+        G = g(t + self.h * numpy.arange(c.size), numpy.tile(x.reshape(-1, 1), (1, c.size)))
+
+        if isinstance(G, list):
+            return sum([c[k] * G[k] for k in range(c.size)])
+        else:
+            return G.dot(c)
+
     def fd_dMdt(self, t, x):
         '''Computes matrix derivative with respect to time by finite differences.
 
@@ -1711,25 +2356,28 @@ class RW(RK):
             dMdt (:obj:`numpy.ndarray`): Matrix derivatives with respect to time.
         '''
 
+        if self.vectorized:
+            return self.fd_time(self.M, t, x)
+
         if self.r < 3:
             # First order
-            dMdt = (self.M(t + self.h, x) - self.M(t, x)) / self.h
+            dMdt = (self.M(t + self.h, x) - self.M_memo(t, x)) / self.h
 
         elif self.r < 4:
             # Second order
-            dMdt = (4.0 * self.M(t + self.h, x) - self.M(t + 2.0 * self.h, x) - 3.0 * self.M(t, x)) / (2.0 * self.h)
+            dMdt = (4.0 * self.M(t + self.h, x) - self.M(t + 2.0 * self.h, x) - 3.0 * self.M_memo(t, x)) / (2.0 * self.h)
 
         elif self.r < 6:
             # Fourth order
             dMdt = (48.0 * self.M(t + self.h, x) - 36.0 * self.M(t + 2.0 * self.h, x) \
-                                                 + 16.0 * self.M(t + 3.0 * self.h, x) - 3.0 * self.M(t + 4.0 * self.h, x) - 25.0 * self.M(t, x)) / (12.0 * self.h)
+                                                 + 16.0 * self.M(t + 3.0 * self.h, x) - 3.0 * self.M(t + 4.0 * self.h, x) - 25.0 * self.M_memo(t, x)) / (12.0 * self.h)
 
         else:
 
             print("Possible order reduction, using fourth order finite differences on time...")
 
             dMdt = (48.0 * self.M(t + self.h, x) - 36.0 * self.M(t + 2.0 * self.h, x) \
-                                                 + 16.0 * self.M(t + 3.0 * self.h, x) - 3.0 * self.M(t + 4.0 * self.h, x) - 25.0 * self.M(t, x)) / (12.0 * self.h)
+                                                 + 16.0 * self.M(t + 3.0 * self.h, x) - 3.0 * self.M(t + 4.0 * self.h, x) - 25.0 * self.M_memo(t, x)) / (12.0 * self.h)
 
         return dMdt
 
@@ -1741,6 +2389,9 @@ class RW(RK):
                 \\frac{\partial^2\\mathbf{f}}{\partial \mathbf{x}^2}(t, \\mathbf{x})\mathbf{y} = \\lim_{\\epsilon\\rightarrow 0}\\frac{\\frac{\\partial \\mathbf{f}}{\\partial \\mathbf{x}}(t, \\mathbf{x} + \\epsilon\\mathbf{y}) - \\frac{\\partial \\mathbf{f}}{\\partial \\mathbf{x}}(t, \\mathbf{x})}{\\epsilon}
             \\end{equation}
 
+        If the source derivative is also computed by finite differences, the jacobian of the directional
+        difference of the source is computed instead, see :class:`fatDAE.base.class_derivatives.fd_directional`.
+
         Args:
             t (:obj:`float`): Time.
             x (:obj:`numpy.ndarray`): State.
@@ -1750,7 +2401,15 @@ class RW(RK):
             (:obj:`numpy.ndarray`): Source second order derivatives with respect to state.
         '''
 
-        return (self.dfdx(t, x + self.h * y) - self.dfdx(t, x)) / self.h
+        epsilon = self.fd_sec.step(x, y)
+
+        if epsilon == None:
+            return 0. * self.dfdx(t, x)
+
+        if self.dfdx == self.fd_dfdx:
+            return self.fd_sec(self.source(t, epsilon * y), self.source(t), x, epsilon, self.dense)
+        else:
+            return (self.dfdx(t, x + epsilon * y) - self.dfdx(t, x)) / epsilon
 
     def fd_d2fdxdt(self, t, x):
         '''Computes source second order derivative with respect to time and state by finite differences.
@@ -1760,6 +2419,9 @@ class RW(RK):
                 \\frac{\partial^2\\mathbf{f}}{\partial \mathbf{x}\partial t}(t, \\mathbf{x}) = \\lim_{h\\rightarrow 0}\\frac{\\frac{\\partial \\mathbf{f}}{\\partial \\mathbf{x}}(t + h, \\mathbf{x}) - \\frac{\\partial \\mathbf{f}}{\\partial \\mathbf{x}}(t, \\mathbf{x})}{h}
             \\end{equation}
 
+        If the source derivative is also computed by finite differences, the jacobian of the difference
+        in time of the source is computed instead, see :class:`fatDAE.base.class_derivatives.fd_directional`.
+
         Args:
             t (:obj:`float`): Time.
             x (:obj:`numpy.ndarray`): State.
@@ -1769,14 +2431,53 @@ class RW(RK):
 
         '''
 
-        return (self.dfdx(t + self.h, x) - self.dfdx(t, x)) / self.h
+        h = self.fd_sec.step(t, 1.0)
+
+        if self.dfdx == self.fd_dfdx:
+            return self.fd_sec(self.source(t + h), self.source(t), x, h, self.dense)
+        else:
+            return (self.dfdx(t + h, x) - self.dfdx(t, x)) / h
 
     def fd_d2fdxdu(self, t, x, y):
         '''Computes source second order derivative with respect to the state and control by finite differences.
+
+        .. math::
+            \\begin{equation}
+                \\frac{\partial}{\partial \\mathbf{u}}\\left(\\frac{\\partial \\mathbf{f}}{\\partial \\mathbf{x}}(t, \\mathbf{x})\\mathbf{y}\\right) = \\lim_{\\epsilon\\rightarrow 0}\\frac{\\frac{\\partial \\mathbf{f}}{\\partial \\mathbf{u}}(t, \\mathbf{x} + \\epsilon\\mathbf{y}) - \\frac{\\partial \\mathbf{f}}{\\partial \\mathbf{u}}(t, \\mathbf{x})}{\\epsilon}
+            \\end{equation}
+
+        Args:
+            t (:obj:`float`): Time.
+            x (:obj:`numpy.ndarray`): State.
+            y (:obj:`numpy.ndarray`): Direction.
+
+        Returns:
+            (:obj:`numpy.ndarray`): Source second order derivatives with respect to state and control.
         '''
-        raise NameError('Feature not implemented yet...')
+
+        epsilon = self.fd_sec.step(x, y)
+
+        if epsilon == None:
+            return 0. * self.dfdu(t, x)
+
+        return (self.dfdu(t, x + epsilon * y) - self.dfdu(t, x)) / epsilon
 
     def fd_d2fdtdu(self, t, x):
         '''Computes source second order derivative with respect to the time and control by finite differences.
+
+        .. math::
+            \\begin{equation}
+                \\frac{\partial^2\\mathbf{f}}{\partial t\partial \\mathbf{u}}(t, \\mathbf{x}) = \\lim_{h\\rightarrow 0}\\frac{\\frac{\\partial \\mathbf{f}}{\\partial \\mathbf{u}}(t + h, \\mathbf{x}) - \\frac{\\partial \\mathbf{f}}{\\partial \\mathbf{u}}(t, \\mathbf{x})}{h}
+            \\end{equation}
+
+        Args:
+            t (:obj:`float`): Time.
+            x (:obj:`numpy.ndarray`): State.
+
+        Returns:
+            (:obj:`numpy.ndarray`): Source second order derivatives with respect to time and control.
         '''
-        raise NameError('Feature not implemented yet...')
+
+        h = self.fd_sec.step(t, 1.0)
+
+        return (self.dfdu(t + h, x) - self.dfdu(t, x)) / h
@@ -0,0 +1,66 @@
+import json, os
+
+import numpy, scipy.sparse
+
+import pytest
+
+import fatDAE.base.class_solvers_sp, fatDAE.class_problem, fatDAE.class_solvers
+
+def load(path):
+    with open(os.path.join(os.path.dirname(__file__), '..', 'json_butcher', path)) as fh:
+        return json.load(fh)
+
+def heat(n=30, affine=False):
+    ''' Heat equation with a time-dependent source.
+    '''
+
+    dx = 1.0 / (n + 1)
+
+    M = scipy.sparse.identity(n, format='csc')
+    A = scipy.sparse.diags([numpy.ones(n - 1), - 2.0 * numpy.ones(n), numpy.ones(n - 1)], [-1, 0, 1], format='csc') / dx ** 2
+
+    x_0 = numpy.sin(numpy.pi * numpy.linspace(dx, 1.0 - dx, n))
+
+    if affine:
+        problem = fatDAE.class_problem.Problem.from_affine(M, A, numpy.ones((n, 1)), lambda t: numpy.array([numpy.sin(t)]), x_0, 0., 0.1)
+    else:
+        problem = fatDAE.class_problem.Problem(M, lambda t, x: A.dot(x) + numpy.sin(t), x_0, 0., 0.1, {'dfdx': lambda t, x: A}, False, True)
+
+    problem.store_level = None; problem.solve_initial = lambda x: x
+
+    return problem
+
+def run(lsolver, adp, affine):
+
+    problem = heat(affine=affine)
+
+    solver = fatDAE.class_solvers.build(load('DIRK/SDIRK3CP.json'), False, True, a_tol=1e-8, r_tol=1e-6, lsolver=lsolver)
+    problem.solve(solver, h=1e-4, adp=adp)
+
+    return problem.x_list[-1]
+
+@pytest.mark.parametrize('affine', [False, True])
+@pytest.mark.parametrize('adp', [False, True])
+@pytest.mark.parametrize('lsolver', ['auto'] + sorted(fatDAE.base.class_solvers_sp.backends))
+def test_linear_lsolver(lsolver, adp, affine):
+
+    x = run(lsolver, adp, affine); x_ref = run('superlu', adp, affine)
+
+    assert numpy.linalg.norm(x - x_ref, numpy.inf) < 1e-6 * numpy.linalg.norm(x_ref, numpy.inf)
+
+def test_ladder_keeps_step_size():
+
+    solver = fatDAE.class_solvers.build(load('DIRK/SDIRK3CP.json'), False, True, h_min=1e-3)
+    solver.affine = {}; solver.error_est = 0.5; solver.q = 2
+
+    solver.controller = lambda *args: 1.0
+
+    for k in [-31, -7, 6]:
+
+        solver.h = solver.h_ladder ** k; solver.adapt()
+
+        assert solver.h == pytest.approx(solver.h_ladder ** k)
+
+    solver.h = 1.1e-3; solver.adapt()
+
+    assert solver.h == 1e-3
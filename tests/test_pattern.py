@@ -0,0 +1,42 @@
+import numpy, scipy.sparse
+
+import fatDAE.base.class_derivatives, fatDAE.class_problem
+
+def coupled(n=150):
+    ''' Diagonal at the initial time, tridiagonal afterwards.
+    '''
+
+    def f(t, x):
+
+        y = - x.copy(); c = 5.0 * numpy.sin(t)
+
+        y[1:] += c * x[:-1]; y[:-1] += c * x[1:]
+
+        return y
+
+    problem = fatDAE.class_problem.Problem(scipy.sparse.identity(n, format='csc'), f, numpy.linspace(0., 1., n), 0., 1.)
+
+    return problem
+
+def test_time_dependent_coupling():
+
+    problem = coupled()
+
+    P = problem.detect_pattern().toarray()
+
+    assert P.sum() == 3 * problem.dim - 2
+    assert numpy.all(numpy.diag(P, 1)) and numpy.all(numpy.diag(P, -1))
+
+def test_time_dependent_coupling_jacobian():
+
+    problem = coupled()
+
+    jacobian = fatDAE.base.class_derivatives.fd_jacobian(problem.detect_pattern())
+
+    t = 0.5 * (problem.t_0 + problem.t_f); c = 5.0 * numpy.sin(t)
+
+    A = jacobian(lambda x: problem.f(t, x), problem.x_0, True)
+
+    exact = - numpy.eye(problem.dim) + c * (numpy.eye(problem.dim, k=1) + numpy.eye(problem.dim, k=-1))
+
+    assert numpy.linalg.norm(A - exact, numpy.inf) < 1e-5